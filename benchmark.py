@@ -0,0 +1,233 @@
+# 負荷・ベンチマーク
+#
+# main.py の FastAPI アプリを、database.py の metadata から作ったローカルDB（既定は SQLite）に
+# つないで起動し、商品スキャン・購入のトラフィックを流して スループット / p50 / p95 / p99 を出力する。
+# ネットワークを介さず ASGI で直接呼ぶため、アプリ + DB 層の処理時間を比較するのに使う。
+#
+#   pip install aiosqlite            # SQLite 用ドライバ（本番の requirements には含めない）
+#   python benchmark.py --save-baseline bench_baseline.json
+#   python benchmark.py --compare bench_baseline.json
+#
+# --database-url で MySQL 互換の使い捨てDBも指定できる（テーブルは作り直すので本番DBは指定しないこと）。
+# --replay には記録済みリクエストの NDJSON（1行 = {"method", "path", "params"?, "json"?}）を渡す。
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description="POS バックエンドの負荷・ベンチマーク")
+    parser.add_argument("--database-url", help="使い捨てDBのURL（省略時は一時ファイルの SQLite）")
+    parser.add_argument("--catalog-size", type=int, default=5000, help="投入する商品数")
+    parser.add_argument("--scans", type=int, default=2000, help="/products/search の回数")
+    parser.add_argument("--batches", type=int, default=200, help="/products/batch の回数")
+    parser.add_argument("--purchases", type=int, default=300, help="購入APIごとの回数")
+    parser.add_argument("--max-basket", type=int, default=40, help="1購入あたりの最大商品数")
+    parser.add_argument("--concurrency", type=int, default=20, help="同時リクエスト数")
+    parser.add_argument("--replay", help="記録済みリクエストの NDJSON")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--save-baseline", metavar="PATH", help="結果をベースラインとして保存")
+    parser.add_argument("--compare", metavar="PATH", help="ベースラインと比較（劣化時は終了コード1）")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="劣化とみなす割合（既定 20%%）")
+    return parser.parse_args()
+
+
+def _prepare_database(url: str, catalog_size: int) -> None:
+    """
+    metadata からテーブルを作り直し、商品マスタを投入します。
+    """
+    import sqlalchemy
+    from database import metadata, products
+
+    sync_url = url.replace("mysql://", "mysql+pymysql://", 1) if url.startswith("mysql://") else url
+    engine = sqlalchemy.create_engine(sync_url)
+    metadata.drop_all(engine)
+    metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(products.insert(), [
+            {"prd_id": i, "code": f"49{i:011d}", "name": f"ベンチ商品{i}", "price": 100 + (i % 50) * 10}
+            for i in range(1, catalog_size + 1)
+        ])
+    engine.dispose()
+
+
+def _percentile(sorted_values, ratio: float) -> float:
+    # nearest-rank 法: 全体の ratio 以上をカバーする最小の順位
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, math.ceil(ratio * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+async def _run_scenario(name, client, requests, concurrency):
+    """
+    requests（(method, path, kwargs) のリスト）を同時実行数 concurrency で流し、結果を集計します。
+    """
+    latencies = []
+    errors = 0
+    queue = iter(requests)
+
+    async def worker():
+        nonlocal errors
+        for method, path, kwargs in queue:
+            started = time.perf_counter()
+            response = await client.request(method, path, **kwargs)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code >= 500:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    result = {
+        "requests": len(latencies),
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(_percentile(latencies, 0.50) * 1000, 2),
+        "p95_ms": round(_percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(_percentile(latencies, 0.99) * 1000, 2),
+    }
+    print(
+        f"📊 {name:<18} {result['requests']:>6}件  {result['throughput_rps']:>8} req/s  "
+        f"p50={result['p50_ms']}ms p95={result['p95_ms']}ms p99={result['p99_ms']}ms  errors={errors}"
+    )
+    return result
+
+
+def _build_scenarios(args, rng):
+    codes = [f"49{i:011d}" for i in range(1, args.catalog_size + 1)]
+
+    def scan_code():
+        # 5% は未登録コード（404 / ネガティブキャッシュの経路）
+        return rng.choice(codes) if rng.random() >= 0.05 else f"99{rng.randrange(10**11):011d}"
+
+    def basket():
+        size = rng.randint(1, args.max_basket)
+        return [
+            (prd_id, rng.randint(1, 5))
+            for prd_id in rng.sample(range(1, args.catalog_size + 1), min(size, args.catalog_size))
+        ]
+
+    def purchase_body(items):
+        total = sum((100 + (prd_id % 50) * 10) * qty for prd_id, qty in items)
+        return {
+            "items": [
+                {"product_id": prd_id, "name": f"ベンチ商品{prd_id}", "price": 100 + (prd_id % 50) * 10, "quantity": qty}
+                for prd_id, qty in items
+            ],
+            "total": total,
+            "totalWithTax": int(total * 1.1),
+        }
+
+    scenarios = {
+        "scan": [("GET", "/products/search", {"params": {"code": scan_code()}}) for _ in range(args.scans)],
+        "batch_lookup": [
+            ("POST", "/products/batch", {"json": {"codes": [scan_code() for _ in range(args.max_basket)]}})
+            for _ in range(args.batches)
+        ],
+        "purchase": [("POST", "/purchases", {"json": purchase_body(basket())}) for _ in range(args.purchases)],
+        # sales.py の購入APIは /purchases が purchases.py と重複しているため、ベンチ用のパスに登録して呼ぶ
+        "sales_purchase": [
+            ("POST", "/bench/sales/purchases", {"json": purchase_body(basket())}) for _ in range(args.purchases)
+        ],
+    }
+
+    if args.replay:
+        with open(args.replay, encoding="utf-8") as f:
+            recorded = [json.loads(line) for line in f if line.strip()]
+        scenarios["replay"] = [
+            (r.get("method", "GET"), r["path"], {k: r[k] for k in ("params", "json") if k in r})
+            for r in recorded
+        ]
+
+    return scenarios
+
+
+def _compare(results, baseline, tolerance) -> bool:
+    """
+    ベースラインより p95 が悪化、またはスループットが低下したシナリオを表示します。
+    """
+    ok = True
+    for name, current in results.items():
+        before = baseline.get("results", {}).get(name)
+        if not before:
+            continue
+        if before["p95_ms"] and current["p95_ms"] > before["p95_ms"] * (1 + tolerance):
+            print(f"⚠️ {name}: p95 {before['p95_ms']}ms -> {current['p95_ms']}ms")
+            ok = False
+        if before["throughput_rps"] and current["throughput_rps"] < before["throughput_rps"] * (1 - tolerance):
+            print(f"⚠️ {name}: throughput {before['throughput_rps']} -> {current['throughput_rps']} req/s")
+            ok = False
+    if ok:
+        print("✅ ベースラインからの劣化なし")
+    return ok
+
+
+async def _run(args) -> dict:
+    import httpx
+    import main
+    import sales
+
+    main.app.include_router(sales.router, prefix="/bench/sales")
+    rng = random.Random(args.seed)
+    scenarios = _build_scenarios(args, rng)
+
+    results = {}
+    async with main.app.router.lifespan_context(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            for name, requests in scenarios.items():
+                results[name] = await _run_scenario(name, client, requests, args.concurrency)
+    return results
+
+
+def main_cli() -> int:
+    args = _parse_args()
+
+    tmpdir = None
+    if args.database_url:
+        url = args.database_url
+    else:
+        tmpdir = tempfile.TemporaryDirectory()
+        url = f"sqlite:///{os.path.join(tmpdir.name, 'bench.db')}"
+
+    # database.py の読込前に接続先を差し替える（.env より優先）
+    os.environ["DATABASE_URL"] = url
+    os.environ["SSL_CA_PATH"] = ""
+    sys.path.insert(0, BASE_DIR)
+
+    _prepare_database(url, args.catalog_size)
+    results = asyncio.run(_run(args))
+
+    exit_code = 0
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if not _compare(results, baseline, args.tolerance):
+            exit_code = 1
+
+    if args.save_baseline:
+        settings = {k: v for k, v in vars(args).items() if k not in ("save_baseline", "compare", "database_url")}
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump({"settings": settings, "results": results}, f, ensure_ascii=False, indent=2)
+        print(f"💾 ベースライン保存: {args.save_baseline}")
+
+    if tmpdir is not None:
+        tmpdir.cleanup()
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
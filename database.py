@@ -1,8 +1,10 @@
+import asyncio
 import os
 import ssl
 import sqlalchemy
 from databases import Database
 from dotenv import load_dotenv
+from metrics import InstrumentedDatabase
 
 # このファイル (database.py) があるディレクトリのパスを取得
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -15,11 +17,30 @@ load_dotenv(dotenv_path=dotenv_path)
 # 環境変数から接続情報を取得
 DATABASE_URL = os.getenv("DATABASE_URL")
 SSL_CA_FILENAME = os.getenv("SSL_CA_PATH") # .envからはファイル名だけ取得
+# 読み取り専用の処理（商品検索・レポート・エクスポート）を向けるレプリカ（任意）
+DATABASE_READ_URL = os.getenv("DATABASE_READ_URL")
 
 # DATABASE_URLが設定されていない場合はエラーを発生させる
 if not DATABASE_URL:
     raise ValueError("DATABASE_URL environment variable must be set.")
 
+# --- コネクションプール設定（ワーカー1つあたり） ---
+# 例: gunicorn 4ワーカー × DB_POOL_MAX_SIZE=10 で最大40接続
+pool_options = {}
+if os.getenv("DB_POOL_MIN_SIZE"):
+    pool_options["min_size"] = int(os.getenv("DB_POOL_MIN_SIZE"))
+if os.getenv("DB_POOL_MAX_SIZE"):
+    pool_options["max_size"] = int(os.getenv("DB_POOL_MAX_SIZE"))
+if os.getenv("DB_POOL_RECYCLE"):
+    # Azure 側でアイドル接続が切られる前に張り直す（秒）
+    pool_options["pool_recycle"] = int(os.getenv("DB_POOL_RECYCLE"))
+if DATABASE_URL.startswith("sqlite"):
+    # SQLite（ローカル・ベンチ用）はプール設定を受け付けない
+    pool_options = {}
+
+# 起動時に SELECT 1 で疎通させておく接続数（既定は最小プールサイズ）
+DB_POOL_WARMUP = int(os.getenv("DB_POOL_WARMUP", pool_options.get("min_size", 1)))
+
 database = None
 ssl_context = None
 
@@ -32,7 +53,7 @@ if SSL_CA_FILENAME:
         print(f"✅ SSL CA file found, creating SSL context: {ssl_ca_path_full}")
         ssl_context = ssl.create_default_context(cafile=ssl_ca_path_full)
         # SSLコンテキストを渡してdatabaseインスタンスを作成
-        database = Database(DATABASE_URL, ssl=ssl_context)
+        database = Database(DATABASE_URL, ssl=ssl_context, **pool_options)
     else:
         print(f"❌ FATAL: SSL CA file not found at expected path: {ssl_ca_path_full}")
         # ファイルが見つからない場合はエラーで停止
@@ -40,7 +61,32 @@ if SSL_CA_FILENAME:
 else:
     # Azure上ではSSL_CA_PATHが設定されている前提だが、ローカルでSSLなしDBを使う場合
     print("⚠️ SSL_CA_PATH not set in .env. Connecting without SSL.")
-    database = Database(DATABASE_URL)
+    database = Database(DATABASE_URL, **pool_options)
+
+# クエリ・トランザクションの所要時間を計測（/metrics で公開）
+database = InstrumentedDatabase(database, "primary")
+
+# 読み取り用（未設定ならプライマリと同じもの）。取引の書き込みは必ず database を使うこと
+read_database = database
+if DATABASE_READ_URL:
+    print("✅ DATABASE_READ_URL set, routing read-only queries to replica.")
+    read_options = {"ssl": ssl_context} if ssl_context else {}
+    read_database = InstrumentedDatabase(Database(DATABASE_READ_URL, **read_options, **pool_options), "replica")
+
+
+async def connect_databases() -> None:
+    """
+    プライマリ（とレプリカ）に接続し、DB_POOL_WARMUP 本の接続を温めます。
+    """
+    for db in dict.fromkeys([database, read_database]):
+        await db.connect()
+        # 別タスクで実行して、それぞれ別の接続を使わせる
+        await asyncio.gather(*(db.fetch_val("SELECT 1") for _ in range(DB_POOL_WARMUP)))
+
+
+async def disconnect_databases() -> None:
+    for db in dict.fromkeys([database, read_database]):
+        await db.disconnect()
 
 
 metadata = sqlalchemy.MetaData()
@@ -79,11 +125,13 @@ transaction_details = sqlalchemy.Table(
     sqlalchemy.Column("tax_cd", sqlalchemy.String(2)),
 )
 
+# 期間指定の処理（エクスポート・集計バックフィル）は datetime で開始 trd_id を引くため、事前に以下のインデックス作成が必要:
+#   CREATE INDEX ix_取引_datetime ON 取引 (datetime);
 transactions = sqlalchemy.Table(
     "取引",
     metadata,
     sqlalchemy.Column("trd_id", sqlalchemy.Integer, primary_key=True),
-    sqlalchemy.Column("datetime", sqlalchemy.TIMESTAMP),
+    sqlalchemy.Column("datetime", sqlalchemy.TIMESTAMP, index=True),
     sqlalchemy.Column("emp_cd", sqlalchemy.String(10)),
     sqlalchemy.Column("store_cd", sqlalchemy.String(5)),
     sqlalchemy.Column("pos_no", sqlalchemy.String(3)),
@@ -105,3 +153,94 @@ transaction_details = sqlalchemy.Table(
     extend_existing=True,  # ← これも追加
 )
 
+
+async def fetch_trd_id_range(db, range_start, range_end):
+    """
+    range_start〜range_end（終端含まず）の取引の (最小 trd_id, 最大 trd_id) を返します（該当なしは (None, None)）。
+    ix_取引_datetime を使うので、trd_id=0 からのキーセット走査で期間外の行を読み飛ばさずに済む。
+    """
+    query = sqlalchemy.select(
+        sqlalchemy.func.min(transactions.c.trd_id).label("min_trd_id"),
+        sqlalchemy.func.max(transactions.c.trd_id).label("max_trd_id"),
+    ).where(transactions.c.datetime >= range_start, transactions.c.datetime < range_end)
+    row = await db.fetch_one(query)
+    return (row.min_trd_id, row.max_trd_id) if row else (None, None)
+
+
+# --- 冪等キー（オフライン同期の重複防止） ---
+# 事前に以下のテーブル作成が必要:
+#   CREATE TABLE 取引冪等キー (
+#       idem_key VARCHAR(64) PRIMARY KEY,
+#       trd_id INT,
+#       created_at TIMESTAMP,
+#       request_hash CHAR(64)
+#   );
+# request_hash は Idempotency-Key ヘッダー付きの登録で、リクエスト内容の SHA-256 を記録する
+# （同じキーで内容の違う再送を 422 にするため）。既存のテーブルには以下で追加:
+#   ALTER TABLE 取引冪等キー ADD COLUMN request_hash CHAR(64);
+purchase_keys = sqlalchemy.Table(
+    "取引冪等キー",
+    metadata,
+    sqlalchemy.Column("idem_key", sqlalchemy.String(64), primary_key=True),
+    sqlalchemy.Column("trd_id", sqlalchemy.Integer, sqlalchemy.ForeignKey("取引.trd_id")),
+    sqlalchemy.Column("created_at", sqlalchemy.TIMESTAMP),
+    sqlalchemy.Column("request_hash", sqlalchemy.String(64)),
+)
+
+# --- 売上集計（ロールアップ） ---
+# 取引・取引明細から時間別/日別に積み上げた集計。事前に以下のテーブル作成が必要:
+#   CREATE TABLE 売上集計_時間 (
+#       bucket DATETIME, store_cd VARCHAR(5), pos_no VARCHAR(3), prd_id INT,
+#       qty INT NOT NULL DEFAULT 0, amount BIGINT NOT NULL DEFAULT 0,
+#       PRIMARY KEY (bucket, store_cd, pos_no, prd_id)
+#   );
+#   CREATE TABLE 売上集計_日次 (
+#       sales_date DATE, store_cd VARCHAR(5), pos_no VARCHAR(3), prd_id INT,
+#       qty INT NOT NULL DEFAULT 0, amount BIGINT NOT NULL DEFAULT 0,
+#       PRIMARY KEY (sales_date, store_cd, pos_no, prd_id)
+#   );
+sales_hourly = sqlalchemy.Table(
+    "売上集計_時間",
+    metadata,
+    sqlalchemy.Column("bucket", sqlalchemy.DateTime, primary_key=True),
+    sqlalchemy.Column("store_cd", sqlalchemy.String(5), primary_key=True),
+    sqlalchemy.Column("pos_no", sqlalchemy.String(3), primary_key=True),
+    sqlalchemy.Column("prd_id", sqlalchemy.Integer, primary_key=True),
+    sqlalchemy.Column("qty", sqlalchemy.Integer, nullable=False, server_default="0"),
+    sqlalchemy.Column("amount", sqlalchemy.BigInteger, nullable=False, server_default="0"),
+)
+
+sales_daily = sqlalchemy.Table(
+    "売上集計_日次",
+    metadata,
+    sqlalchemy.Column("sales_date", sqlalchemy.Date, primary_key=True),
+    sqlalchemy.Column("store_cd", sqlalchemy.String(5), primary_key=True),
+    sqlalchemy.Column("pos_no", sqlalchemy.String(3), primary_key=True),
+    sqlalchemy.Column("prd_id", sqlalchemy.Integer, primary_key=True),
+    sqlalchemy.Column("qty", sqlalchemy.Integer, nullable=False, server_default="0"),
+    sqlalchemy.Column("amount", sqlalchemy.BigInteger, nullable=False, server_default="0"),
+)
+
+# --- 商品カタログのバージョン（全ワーカー共通） ---
+# 価格変更などで値を +1 すると、各ワーカーが検知して商品キャッシュを捨てる。事前に以下が必要:
+#   CREATE TABLE カタログバージョン (id INT PRIMARY KEY, version INT NOT NULL);
+#   INSERT INTO カタログバージョン (id, version) VALUES (1, 0);
+# 商品マスタを SQL で直接更新した場合も同じ行を更新すること:
+#   UPDATE カタログバージョン SET version = version + 1 WHERE id = 1;
+catalog_versions = sqlalchemy.Table(
+    "カタログバージョン",
+    metadata,
+    sqlalchemy.Column("id", sqlalchemy.Integer, primary_key=True),
+    sqlalchemy.Column("version", sqlalchemy.Integer, nullable=False),
+)
+
+# --- 数量モード（任意） ---
+# DETAIL_QTY_MODE=1 のとき、同一商品 N 個を取引明細 1 行 (qty=N) で記録する。
+# 事前に以下のマイグレーションが必要:
+#   ALTER TABLE 取引明細 ADD COLUMN qty INT NOT NULL DEFAULT 1;
+DETAIL_QTY_MODE = os.getenv("DETAIL_QTY_MODE", "0") == "1"
+
+if DETAIL_QTY_MODE:
+    transaction_details.append_column(
+        sqlalchemy.Column("qty", sqlalchemy.Integer, nullable=False, server_default="1")
+    )
@@ -0,0 +1,152 @@
+import csv
+import datetime
+import io
+import json
+import zlib
+from typing import Optional
+import sqlalchemy
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
+from database import read_database, transactions, transaction_details, fetch_trd_id_range, DETAIL_QTY_MODE
+
+router = APIRouter(prefix="/exports")
+
+# 1回のクエリで取得する行数（メモリ使用量はこの件数分で頭打ち）
+EXPORT_PAGE_SIZE = 1000
+
+_TRD_COLUMNS = [
+    transactions.c.trd_id,
+    transactions.c.datetime,
+    transactions.c.emp_cd,
+    transactions.c.store_cd,
+    transactions.c.pos_no,
+    transactions.c.total_amt,
+    transactions.c.ttl_amt_ex_tax,
+]
+_DTL_COLUMNS = [
+    transaction_details.c.trd_id,
+    transaction_details.c.dtl_id,
+    transaction_details.c.prd_id,
+    transaction_details.c.prd_code,
+    transaction_details.c.prd_name,
+    transaction_details.c.prd_price,
+    transaction_details.c.tax_cd,
+]
+if DETAIL_QTY_MODE:
+    _DTL_COLUMNS.append(transaction_details.c.qty)
+
+_FIELD_NAMES = list(dict.fromkeys(column.name for column in _TRD_COLUMNS + _DTL_COLUMNS))
+
+
+async def _iter_pages(range_start: datetime.datetime, range_end: datetime.datetime):
+    """
+    取引を trd_id のキーセットで EXPORT_PAGE_SIZE 件ずつ取得し、その明細を IN (...) でまとめて引きます（OFFSET は使わない）。
+    どちらも主キー / trd_id の順に読めるクエリなので、ページごとの処理量はページの大きさで頭打ちになる。
+    走査は期間内の最小〜最大 trd_id に限定する（datetime インデックスで先に引く）。
+    """
+    min_trd_id, max_trd_id = await fetch_trd_id_range(read_database, range_start, range_end)
+    if min_trd_id is None:
+        return
+
+    last_trd_id = min_trd_id - 1
+    while True:
+        trd_query = (
+            sqlalchemy.select(*_TRD_COLUMNS)
+            .where(
+                transactions.c.datetime >= range_start,
+                transactions.c.datetime < range_end,
+                transactions.c.trd_id > last_trd_id,
+                transactions.c.trd_id <= max_trd_id,
+            )
+            .order_by(transactions.c.trd_id)
+            .limit(EXPORT_PAGE_SIZE)
+        )
+        trd_rows = await read_database.fetch_all(trd_query)
+        if not trd_rows:
+            return
+
+        trd_ids = [row.trd_id for row in trd_rows]
+        dtl_query = (
+            sqlalchemy.select(*_DTL_COLUMNS)
+            .where(transaction_details.c.trd_id.in_(trd_ids))
+            .order_by(transaction_details.c.trd_id, transaction_details.c.dtl_id)
+        )
+        details_by_trd = {}
+        for row in await read_database.fetch_all(dtl_query):
+            details_by_trd.setdefault(row.trd_id, []).append(row._mapping)
+
+        page = [
+            {**trd_row._mapping, **detail}
+            for trd_row in trd_rows
+            for detail in details_by_trd.get(trd_row.trd_id, [])
+        ]
+        if page:
+            yield page
+        last_trd_id = trd_ids[-1]
+        if len(trd_rows) < EXPORT_PAGE_SIZE:
+            return
+
+
+async def _encode_csv(pages):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=_FIELD_NAMES)
+    writer.writeheader()
+    async for page in pages:
+        writer.writerows(page)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+async def _encode_ndjson(pages):
+    async for page in pages:
+        yield "".join(json.dumps(row, ensure_ascii=False, default=str) + "\n" for row in page).encode("utf-8")
+
+
+async def _gzip(chunks):
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+    async for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+@router.get("/transactions")
+async def export_transactions(
+    start: datetime.date,
+    end: Optional[datetime.date] = None,
+    format: str = "csv",
+    gzip: bool = False,
+):
+    """
+    取引 + 取引明細 を start〜end（両端含む）で CSV / NDJSON としてストリーミング出力します。
+    """
+    if format not in ("csv", "ndjson"):
+        raise HTTPException(status_code=400, detail="format は csv または ndjson を指定してください")
+    end = end or start
+
+    range_start = datetime.datetime.combine(start, datetime.time.min)
+    range_end = datetime.datetime.combine(end + datetime.timedelta(days=1), datetime.time.min)
+
+    pages = _iter_pages(range_start, range_end)
+    if format == "csv":
+        body = _encode_csv(pages)
+        media_type = "text/csv; charset=utf-8"
+    else:
+        body = _encode_ndjson(pages)
+        media_type = "application/x-ndjson"
+
+    filename = f"transactions_{start:%Y%m%d}_{end:%Y%m%d}.{format}"
+    if gzip:
+        body = _gzip(body)
+        media_type = "application/gzip"
+        filename += ".gz"
+
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
@@ -0,0 +1,133 @@
+import asyncio
+import hashlib
+import os
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+from fastapi import HTTPException
+from pydantic import BaseModel
+from cache import TTLCache
+from purchase_store import find_purchase_key
+
+# --- Idempotency-Key 設定 ---
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "10000"))
+IDEMPOTENCY_CACHE_TTL = float(os.getenv("IDEMPOTENCY_CACHE_TTL", "600"))
+IDEMPOTENCY_KEY_MAX_LENGTH = 64  # 取引冪等キー.idem_key の長さ
+
+# (scope, キー) -> (リクエストのハッシュ, 返した応答)
+# （このワーカー分の高速経路。正しさは 取引冪等キー の一意制約で担保）
+response_cache = TTLCache(IDEMPOTENCY_CACHE_SIZE, IDEMPOTENCY_CACHE_TTL)
+# 処理中の (scope, キー) -> (リクエストのハッシュ, 応答の Future)（同時に届いた同じキーはここで合流させる）
+_in_flight: Dict[Tuple[str, str], Tuple[str, asyncio.Future]] = {}
+
+
+class _Abandoned(Exception):
+    """
+    処理中だった呼び出し元がキャンセルされたことを待機側へ知らせる（待機側は自分で実行し直す）。
+    """
+
+
+def request_hash(scope: str, request: BaseModel) -> str:
+    """
+    scope（API ごとの名前）とリクエスト内容の SHA-256。同じキーで別の API・別の内容を送った再送の検出に使う。
+    """
+    return hashlib.sha256(f"{scope}\n{request.model_dump_json()}".encode("utf-8")).hexdigest()
+
+
+def _conflict() -> HTTPException:
+    return HTTPException(
+        status_code=422,
+        detail="この Idempotency-Key は別の内容のリクエストで使用済みです",
+    )
+
+
+async def run_idempotent(
+    scope: str,
+    key: Optional[str],
+    request: BaseModel,
+    handler: Callable[[Optional[str], Optional[str]], Awaitable[dict]],
+    replay: Callable[[int], Awaitable[dict]],
+) -> dict:
+    """
+    Idempotency-Key 付きの購入登録を1回だけ実行します。
+    - 応答キャッシュにあればそのまま返す
+    - 同じキーが処理中ならその結果を待つ（処理中の呼び出しがキャンセルされたら自分で実行し直す）
+    - 取引冪等キー に登録済みなら await replay(trd_id) で登録済みの取引から応答を組み立てて返す（明細には触れない）
+    - 同じキーで内容の違うリクエスト（別の API を含む）は 422
+    handler には (キー, リクエストのハッシュ) を渡すので、取引と同じトランザクションで 取引冪等キー に登録すること。
+    """
+    if key is None:
+        return await handler(None, None)
+    if not key or len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Idempotency-Key は1〜{IDEMPOTENCY_KEY_MAX_LENGTH}文字で指定してください",
+        )
+
+    digest = request_hash(scope, request)
+    slot = (scope, key)
+
+    cached = response_cache.get(slot)
+    if cached is not None:
+        cached_digest, response = cached
+        if cached_digest != digest:
+            raise _conflict()
+        return response
+
+    while slot in _in_flight:
+        running_digest, running = _in_flight[slot]
+        if running_digest != digest:
+            raise _conflict()
+        try:
+            return await asyncio.shield(running)
+        except _Abandoned:
+            # 先行の呼び出しがキャンセルされた。別の待機側が引き継いでいればそれを待ち、いなければ自分で実行
+            continue
+
+    future = asyncio.get_running_loop().create_future()
+    _in_flight[slot] = (digest, future)
+    try:
+        response = await _run_once(key, digest, handler, replay)
+    except asyncio.CancelledError:
+        # キャンセルは待機側へ伝えない（クライアント切断などで他の同一キーの要求まで失敗させない）
+        future.set_exception(_Abandoned())
+        future.exception()
+        raise
+    except Exception as e:
+        future.set_exception(e)
+        # 待っている呼び出し元がいなくても警告を出さない
+        future.exception()
+        raise
+    else:
+        response_cache.set(slot, (digest, response))
+        future.set_result(response)
+        return response
+    finally:
+        _in_flight.pop(slot, None)
+
+
+async def _replay_stored(key: str, digest: str, replay) -> Optional[dict]:
+    """
+    登録済みのキーなら元の取引の応答を返します（未登録は None、内容違いは 422）。
+    request_hash が無い行（列追加前・一括登録）は内容を確認できないので、そのまま再送として扱う。
+    """
+    stored = await find_purchase_key(key)
+    if stored is None:
+        return None
+    if stored.request_hash is not None and stored.request_hash != digest:
+        raise _conflict()
+    print(f"🔁 再送を検出: key={key} trd_id={stored.trd_id}")
+    return await replay(stored.trd_id)
+
+
+async def _run_once(key: str, digest: str, handler, replay) -> dict:
+    response = await _replay_stored(key, digest, replay)
+    if response is not None:
+        return response
+
+    try:
+        return await handler(key, digest)
+    except Exception:
+        # 別ワーカーが同じキーを先に登録した場合は一意制約違反になる → 登録済みの取引を返す
+        response = await _replay_stored(key, digest, replay)
+        if response is not None:
+            return response
+        raise
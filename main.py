@@ -1,16 +1,36 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
-from database import database
+import asyncio
+from database import connect_databases, disconnect_databases
 import products
 import sales
 import purchases
+import purchase_store
+import reports
+import exports
+import metrics
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    await database.connect()
+    await connect_databases()
+    # 全ワーカー共通のカタログバージョンを読み、以降は定期的に確認する
+    try:
+        products.catalog_version = await products.fetch_catalog_version()
+    except Exception as e:
+        print("⚠️ カタログバージョンを取得できません（テーブル未作成？）:", str(e))
+    # 手入力検索用の索引を作成し、以降は定期的に差分更新
+    await products.build_product_index()
+    # 商品キャッシュを温めておく（スキャン初回のDB往復を避ける）
+    await products.warm_product_cache()
+    index_refresh = asyncio.create_task(products.run_product_index_refresh())
+    version_watch = asyncio.create_task(products.run_catalog_version_watch())
     yield
-    await database.disconnect()
+    version_watch.cancel()
+    index_refresh.cancel()
+    # グループコミット待ちの購入を書き切ってから切断
+    await purchase_store.group_committer.drain()
+    await disconnect_databases()
 
 # ▼▼▼ 'prefix="/api/v1"' を削除した元の形に戻します ▼▼▼
 app = FastAPI(lifespan=lifespan)
@@ -21,6 +41,9 @@ origins = [
     "http://localhost:3000",  # ローカル開発用（必要なら残す）
 ]
 
+# ✅ ルート別レイテンシ計測（/metrics で公開）
+app.add_middleware(metrics.MetricsMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
@@ -33,6 +56,9 @@ app.add_middleware(
 app.include_router(products.router)
 app.include_router(purchases.router)
 app.include_router(sales.router)
+app.include_router(reports.router)
+app.include_router(exports.router)
+app.include_router(metrics.router)
 
 
 # ✅ 動作確認用のルート（疎通テストに便利）
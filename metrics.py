@@ -0,0 +1,332 @@
+import os
+import re
+import time
+from bisect import bisect_left
+from functools import lru_cache
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+router = APIRouter()
+
+# この時間（ミリ秒）を超えたクエリをログに出す。0 で無効
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "0"))
+
+# ヒストグラムのバケット（秒）
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """
+    ラベルごとの件数・合計・バケット別件数を持つ簡易ヒストグラム（Prometheus 形式で出力）。
+    """
+
+    def __init__(self, name: str, help_text: str, label_names, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        # labels -> [バケット別件数..., +Inf件数, 合計]
+        self._series = {}
+
+    def observe(self, labels: tuple, value: float) -> None:
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help_text}"
+        yield f"# TYPE {self.name} histogram"
+        for labels, series in sorted(self._series.items()):
+            label_text = ",".join(f'{k}="{v}"' for k, v in zip(self.label_names, labels))
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                yield f'{self.name}_bucket{{{label_text},le="{bound}"}} {cumulative}'
+            cumulative += series[len(self.buckets)]
+            yield f'{self.name}_bucket{{{label_text},le="+Inf"}} {cumulative}'
+            yield f"{self.name}_sum{{{label_text}}} {series[-1]}"
+            yield f"{self.name}_count{{{label_text}}} {cumulative}"
+
+
+class Gauge:
+    def __init__(self, name: str, help_text: str, label_names):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._values = {}
+
+    def inc(self, labels: tuple, amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def set(self, labels: tuple, value: float) -> None:
+        self._values[labels] = value
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help_text}"
+        yield f"# TYPE {self.name} gauge"
+        for labels, value in sorted(self._values.items()):
+            label_text = ",".join(f'{k}="{v}"' for k, v in zip(self.label_names, labels))
+            yield f"{self.name}{{{label_text}}} {value}"
+
+
+http_request_duration = Histogram(
+    "pos_http_request_duration_seconds", "HTTP request latency by route.", ("method", "route", "status")
+)
+http_requests_in_flight = Gauge(
+    "pos_http_requests_in_flight", "HTTP requests currently being handled.", ("method",)
+)
+db_query_duration = Histogram(
+    "pos_db_query_duration_seconds", "Database query latency by statement shape.", ("db", "operation", "statement")
+)
+db_transaction_duration = Histogram(
+    "pos_db_transaction_duration_seconds", "Database transaction duration.", ("db", "outcome")
+)
+
+db_pool_wait = Histogram(
+    "pos_db_pool_wait_seconds", "Time spent waiting to acquire a pooled connection.", ("db",)
+)
+
+
+class PoolGauges:
+    """
+    接続プールの状態（待ち件数・使用中・空き・上限）をスクレイプ時に読み出します。
+    """
+
+    def __init__(self):
+        self.pools = {}  # db ラベル -> _TimedPool
+
+    def render(self):
+        yield "# HELP pos_db_pool_connections Connection pool state (waiting/in_use/free/max)."
+        yield "# TYPE pos_db_pool_connections gauge"
+        for label, pool in sorted(self.pools.items()):
+            states = {"waiting": pool.waiting}
+            # aiomysql のプールのみ size/freesize/maxsize を持つ
+            if hasattr(pool, "maxsize"):
+                states.update(in_use=pool.size - pool.freesize, free=pool.freesize, max=pool.maxsize)
+            for state, value in states.items():
+                yield f'pos_db_pool_connections{{db="{label}",state="{state}"}} {value}'
+
+
+db_pool_connections = PoolGauges()
+
+REGISTRY = [
+    http_request_duration,
+    http_requests_in_flight,
+    db_query_duration,
+    db_transaction_duration,
+    db_pool_wait,
+    db_pool_connections,
+]
+
+
+# -------------------------------
+# 💡 HTTP ミドルウェア
+# -------------------------------
+
+class MetricsMiddleware:
+    """
+    ルート（パステンプレート）ごとのレイテンシと処理中件数を記録する ASGI ミドルウェア。
+    ストリーミング応答は送信完了までを計測します。
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        status_code = 500
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        # ルートはマッチング後に scope["route"] に入るため、処理中件数はメソッド単位で数える
+        http_requests_in_flight.inc((method,))
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            http_requests_in_flight.inc((method,), -1)
+            route = scope.get("route")
+            route_path = getattr(route, "path", None) or "unmatched"
+            http_request_duration.observe((method, route_path, str(status_code)), time.perf_counter() - start)
+
+
+# -------------------------------
+# 💡 データベース計測ラッパー
+# -------------------------------
+
+_SQL_SHAPE = re.compile(r"^\s*(\w+)\b.*?\b(?:INTO|FROM|UPDATE)\s+`?([^\s`(]+)", re.IGNORECASE | re.DOTALL)
+
+
+@lru_cache(maxsize=256)
+def _text_shape(sql: str):
+    match = _SQL_SHAPE.match(sql)
+    if not match:
+        return sql.split(None, 1)[0].upper() if sql.strip() else "UNKNOWN", "-"
+    return match.group(1).upper(), match.group(2)
+
+
+def statement_shape(query):
+    """
+    クエリを (操作, テーブル) に要約します。SQL文字列はコンパイルせずに判定する（低オーバーヘッド）。
+    """
+    if isinstance(query, str):
+        return _text_shape(query)
+
+    table = getattr(query, "table", None)
+    if table is not None:
+        operation = type(query).__name__.upper()
+        return operation, getattr(table, "name", str(table))
+
+    froms = getattr(query, "get_final_froms", None)
+    if froms is not None:
+        names = []
+        for from_ in froms():
+            names.extend(t.name for t in getattr(from_, "_from_objects", [from_]) if hasattr(t, "name"))
+        return "SELECT", "+".join(dict.fromkeys(names)) or "-"
+
+    return type(query).__name__.upper(), "-"
+
+
+class _TimedPool:
+    """
+    バックエンドのプールを包み、接続取得の待ち時間と待ち件数を記録します。
+    """
+
+    def __init__(self, pool, db_label: str):
+        self._pool = pool
+        self._db_label = db_label
+        self.waiting = 0
+
+    async def acquire(self):
+        self.waiting += 1
+        started = time.perf_counter()
+        try:
+            return await self._pool.acquire()
+        finally:
+            self.waiting -= 1
+            db_pool_wait.observe((self._db_label,), time.perf_counter() - started)
+
+    def __getattr__(self, name):
+        return getattr(self._pool, name)
+
+
+class _InstrumentedTransaction:
+    def __init__(self, transaction, db_label: str):
+        self._transaction = transaction
+        self._db_label = db_label
+        self._start = None
+
+    async def __aenter__(self):
+        self._start = time.perf_counter()
+        return await self._transaction.__aenter__()
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        try:
+            return await self._transaction.__aexit__(exc_type, exc_value, traceback)
+        finally:
+            outcome = "commit" if exc_type is None else "rollback"
+            db_transaction_duration.observe((self._db_label, outcome), time.perf_counter() - self._start)
+
+    def __getattr__(self, name):
+        return getattr(self._transaction, name)
+
+
+class InstrumentedDatabase:
+    """
+    databases.Database をラップして、クエリ・トランザクションの所要時間を記録します。
+    それ以外の属性（connect, url など）はそのまま元のオブジェクトへ委譲します。
+    """
+
+    def __init__(self, database, db_label: str = "primary"):
+        self._database = database
+        self._db_label = db_label
+
+    def __getattr__(self, name):
+        return getattr(self._database, name)
+
+    async def connect(self):
+        await self._database.connect()
+        # 接続後に作られるプールを包んで、取得待ちを計測する
+        backend = self._database._backend
+        pool = getattr(backend, "_pool", None)
+        if pool is not None and not isinstance(pool, _TimedPool):
+            backend._pool = _TimedPool(pool, self._db_label)
+            db_pool_connections.pools[self._db_label] = backend._pool
+
+    def _record(self, operation: str, query, started: float) -> None:
+        elapsed = time.perf_counter() - started
+        shape = statement_shape(query)
+        db_query_duration.observe((self._db_label, operation, " ".join(shape)), elapsed)
+        if SLOW_QUERY_MS and elapsed * 1000 >= SLOW_QUERY_MS:
+            print(f"🐢 SLOW QUERY {elapsed * 1000:.1f}ms [{self._db_label}] {operation} {' '.join(shape)}")
+
+    async def execute(self, query, values=None):
+        started = time.perf_counter()
+        try:
+            return await self._database.execute(query, values)
+        finally:
+            self._record("execute", query, started)
+
+    async def execute_many(self, query, values):
+        started = time.perf_counter()
+        try:
+            return await self._database.execute_many(query, values)
+        finally:
+            self._record("execute_many", query, started)
+
+    async def fetch_all(self, query, values=None):
+        started = time.perf_counter()
+        try:
+            return await self._database.fetch_all(query, values)
+        finally:
+            self._record("fetch_all", query, started)
+
+    async def fetch_one(self, query, values=None):
+        started = time.perf_counter()
+        try:
+            return await self._database.fetch_one(query, values)
+        finally:
+            self._record("fetch_one", query, started)
+
+    async def fetch_val(self, query, values=None, column=0):
+        started = time.perf_counter()
+        try:
+            return await self._database.fetch_val(query, values, column=column)
+        finally:
+            self._record("fetch_val", query, started)
+
+    async def iterate(self, query, values=None):
+        started = time.perf_counter()
+        try:
+            async for record in self._database.iterate(query, values):
+                yield record
+        finally:
+            self._record("iterate", query, started)
+
+    def transaction(self, **kwargs):
+        return _InstrumentedTransaction(self._database.transaction(**kwargs), self._db_label)
+
+
+# -------------------------------
+# 💡 /metrics
+# -------------------------------
+
+@router.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    """
+    Prometheus テキスト形式で計測値を返します（このワーカー分）。
+    """
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return PlainTextResponse("\n".join(lines) + "\n", media_type="text/plain; version=0.0.4")
@@ -0,0 +1,198 @@
+import unicodedata
+from array import array
+from bisect import bisect_left, insort
+from typing import Dict, List, Optional, Tuple
+
+# 全角カタカナ（ァ〜ヶ）をひらがなへ寄せる変換表
+_KATAKANA_TO_HIRAGANA = {code: code - 0x60 for code in range(0x30A1, 0x30F6 + 1)}
+
+
+def normalize(text: Optional[str]) -> str:
+    """
+    検索用に正規化します。
+    NFKC（全角英数→半角、半角カナ→全角）→ 小文字化 → カタカナ→ひらがな → 空白除去。
+    """
+    if not text:
+        return ""
+    return "".join(unicodedata.normalize("NFKC", text).lower().translate(_KATAKANA_TO_HIRAGANA).split())
+
+
+def _grams(text: str) -> Dict[str, int]:
+    """
+    1文字・2文字の部分文字列 -> 最初の出現位置。
+    """
+    grams: Dict[str, int] = {}
+    for i in range(len(text)):
+        grams.setdefault(text[i], i)
+        if i + 1 < len(text):
+            grams.setdefault(text[i:i + 2], i)
+    return grams
+
+
+# 転置索引の要素は (出現位置, 商品名の長さ, prd_id) を1つの整数に詰めて array('Q') に昇順で持つ
+# （タプルのリストよりメモリが1桁小さく、整数の大小がそのまま順位の下限になる）
+_POS_SHIFT, _LEN_SHIFT = 44, 32
+_POS_MAX, _LEN_MAX, _ID_MASK = (1 << 20) - 1, (1 << 12) - 1, (1 << 32) - 1
+
+
+def _posting(position: int, length: int, prd_id: int) -> int:
+    return (min(position, _POS_MAX) << _POS_SHIFT) | (min(length, _LEN_MAX) << _LEN_SHIFT) | prd_id
+
+
+def _name_rank(position: int) -> tuple:
+    # 商品名前方一致 > 部分一致（出現位置が前ほど上位）
+    return (2, 0) if position == 0 else (3, position)
+
+
+class ProductIndex:
+    """
+    商品コード・商品名の前方一致 / 部分一致をメモリ上で引くための索引。
+    - コード前方一致: 正規化済みコードのソート済みリストを二分探索
+    - 商品名: 1文字・2文字の転置索引を (出現位置, 名前の長さ, prd_id) 順に持ち、
+      順位の良い方から確認して limit 件そろった時点で打ち切る
+    """
+
+    def __init__(self):
+        self._reset()
+
+    def _reset(self) -> None:
+        self._products: Dict[int, dict] = {}
+        self._normalized: Dict[int, tuple] = {}  # prd_id -> (code, name)
+        self._code_keys: List[tuple] = []  # (正規化コード, prd_id)
+        self._grams: Dict[str, array] = {}
+
+    def __len__(self) -> int:
+        return len(self._products)
+
+    def build(self, rows) -> None:
+        """
+        全件から索引を作り直します（キーを集めてから1回だけソート）。
+        """
+        self._reset()
+        for row in rows:
+            self._products[row["prd_id"]] = dict(row)
+
+        postings: Dict[str, List[int]] = {}
+        for prd_id, product in self._products.items():
+            code, name = normalize(product.get("code")), normalize(product.get("name"))
+            self._normalized[prd_id] = (code, name)
+            self._code_keys.append((code, prd_id))
+            base = _posting(0, len(name), prd_id)
+            for gram, position in _grams(name).items():
+                postings.setdefault(gram, []).append(base | (min(position, _POS_MAX) << _POS_SHIFT))
+
+        self._code_keys.sort()
+        self._grams = {gram: array("Q", sorted(keys)) for gram, keys in postings.items()}
+
+    def sync(self, rows) -> Tuple[int, int]:
+        """
+        全件と突き合わせ、追加・変更された商品を反映し、無くなった商品を削除します。
+        (反映件数, 削除件数) を返します。
+        """
+        seen = set()
+        changed = 0
+        for row in rows:
+            seen.add(row["prd_id"])
+            if self._products.get(row["prd_id"]) != row:
+                self.upsert(row)
+                changed += 1
+        removed = [prd_id for prd_id in self._products if prd_id not in seen]
+        for prd_id in removed:
+            self.remove(prd_id)
+        return changed, len(removed)
+
+    def upsert(self, product: dict) -> None:
+        prd_id = product["prd_id"]
+        if self._products.get(prd_id) == product:
+            return
+        if prd_id in self._products:
+            self.remove(prd_id)
+
+        code, name = normalize(product.get("code")), normalize(product.get("name"))
+        self._products[prd_id] = dict(product)
+        self._normalized[prd_id] = (code, name)
+        insort(self._code_keys, (code, prd_id))
+        for gram, position in _grams(name).items():
+            keys = self._grams.setdefault(gram, array("Q"))
+            insort(keys, _posting(position, len(name), prd_id))
+
+    def remove(self, prd_id: int) -> None:
+        if prd_id not in self._products:
+            return
+        code, name = self._normalized.pop(prd_id)
+        del self._products[prd_id]
+        key = (code, prd_id)
+        i = bisect_left(self._code_keys, key)
+        if i < len(self._code_keys) and self._code_keys[i] == key:
+            del self._code_keys[i]
+        for gram, position in _grams(name).items():
+            keys = self._grams.get(gram)
+            if keys is None:
+                continue
+            posting = _posting(position, len(name), prd_id)
+            i = bisect_left(keys, posting)
+            if i < len(keys) and keys[i] == posting:
+                del keys[i]
+            if not keys:
+                del self._grams[gram]
+
+    def _code_prefix(self, query: str, limit: int) -> List[int]:
+        matched = []
+        i = bisect_left(self._code_keys, (query,))
+        while i < len(self._code_keys) and len(matched) < limit and self._code_keys[i][0].startswith(query):
+            matched.append(self._code_keys[i][1])
+            i += 1
+        return matched
+
+    def _name_matches(self, query: str, limit: int) -> List[tuple]:
+        """
+        商品名に query を含む商品の上位 limit 件を (順位, 名前の長さ, prd_id) で返します。
+        query 内で最も件数の少ない 1〜2文字を選び、その転置索引を先頭から確認する。
+        要素の (出現位置 - query 内の位置, 長さ, prd_id) は以降の候補の順位の下限なので、
+        limit 件そろって最下位がその下限より良ければ打ち切れる。
+        """
+        if len(query) == 1:
+            choices = [(query, 0)]
+        else:
+            choices = [(query[i:i + 2], i) for i in range(len(query) - 1)]
+        if any(gram not in self._grams for gram, _ in choices):
+            return []
+        gram, offset = min(choices, key=lambda choice: len(self._grams[choice[0]]))
+
+        best: List[tuple] = []
+        for posting in self._grams[gram]:
+            length = (posting >> _LEN_SHIFT) & _LEN_MAX
+            prd_id = posting & _ID_MASK
+            if len(best) >= limit:
+                bound = (_name_rank(max((posting >> _POS_SHIFT) - offset, 0)), length, prd_id)
+                if bound >= best[-1]:
+                    break
+            name = self._normalized[prd_id][1]
+            position = name.find(query)
+            if position < 0:
+                continue
+            insort(best, (_name_rank(position), len(name), prd_id))
+            del best[limit:]
+        return best
+
+    def search(self, query: str, limit: int = 10) -> List[dict]:
+        """
+        上位 limit 件を返します。
+        順位: コード完全一致 > コード前方一致 > 商品名前方一致 > 商品名部分一致（出現位置が前ほど上位）。
+        同順位は商品名の短い方、prd_id の小さい方を上位にします。
+        """
+        q = normalize(query)
+        if not q or limit <= 0:
+            return []
+
+        ranked: Dict[int, tuple] = {}
+        for prd_id in self._code_prefix(q, limit):
+            code, name = self._normalized[prd_id]
+            ranked[prd_id] = ((0 if code == q else 1, 0), len(name), prd_id)
+        for key in self._name_matches(q, limit):
+            prd_id = key[2]
+            if prd_id not in ranked or key < ranked[prd_id]:
+                ranked[prd_id] = key
+
+        ordered = sorted(ranked.values())[:limit]
+        return [self._products[prd_id] for _, _, prd_id in ordered]
@@ -1,17 +1,252 @@
+import asyncio
+import os
+from typing import List, Optional, Tuple
 from fastapi import APIRouter, HTTPException
-from database import database, products
+from pydantic import BaseModel
+from database import database, read_database, products, catalog_versions
+from cache import TTLCache
+from product_index import ProductIndex
 
 # ✅ prefixを追加
 router = APIRouter(prefix="/products")
 
+# --- 商品キャッシュ設定 ---
+PRODUCT_CACHE_SIZE = int(os.getenv("PRODUCT_CACHE_SIZE", "10000"))
+# カタログバージョンを更新し忘れた直接更新でも、この秒数で最新価格に戻る
+PRODUCT_CACHE_TTL = float(os.getenv("PRODUCT_CACHE_TTL", "30"))
+# 存在しないコード（404）は短めに覚えておく
+PRODUCT_CACHE_NEGATIVE_TTL = float(os.getenv("PRODUCT_CACHE_NEGATIVE_TTL", "10"))
+
+# 一括検索で1回の IN (...) に載せるコード数の上限
+BATCH_CHUNK_SIZE = 500
+
+# 商品コード -> 商品(dict) / 未登録コード -> _NOT_FOUND
+product_cache = TTLCache(PRODUCT_CACHE_SIZE, PRODUCT_CACHE_TTL)
+_NOT_FOUND = object()
+
+# 手入力検索用の索引（起動時に全件、以降は定期的に全件と突き合わせて追加・変更・削除を反映）
+product_index = ProductIndex()
+PRODUCT_INDEX_REFRESH_SEC = float(os.getenv("PRODUCT_INDEX_REFRESH_SEC", "60"))
+
+# このワーカーが読み込んだカタログのバージョン（カタログバージョン テーブルの値）
+catalog_version = 0
+# カタログバージョンを確認する間隔（秒）
+PRODUCT_CACHE_VERSION_POLL_SEC = float(os.getenv("PRODUCT_CACHE_VERSION_POLL_SEC", "5"))
+# 監視タスクと /cache/reload が同じ version で二重に読み直さないようにする
+_reload_lock = asyncio.Lock()
+
+
+def cache_product(row) -> dict:
+    """
+    DBの行をdictにしてキャッシュへ登録します。
+    """
+    product = dict(row._mapping)
+    product_cache.set(product["code"], product)
+    # DBから読んだ最新の内容で索引も更新（変更がなければ何もしない）
+    product_index.upsert(product)
+    return product
+
+
+async def warm_product_cache() -> int:
+    """
+    起動時に商品マスタをキャッシュへ読み込みます（上限件数まで）。
+    """
+    query = products.select().order_by(products.c.prd_id).limit(PRODUCT_CACHE_SIZE)
+    rows = await read_database.fetch_all(query)
+    for row in rows:
+        cache_product(row)
+    print(f"✅ 商品キャッシュ読込: {len(rows)}件 (version={catalog_version})")
+    return len(rows)
+
+
+async def build_product_index() -> int:
+    """
+    商品マスタ全件から検索索引を作ります。
+    """
+    rows = await read_database.fetch_all(products.select())
+    product_index.build(dict(row._mapping) for row in rows)
+    print(f"✅ 商品検索索引作成: {len(product_index)}件")
+    return len(product_index)
+
+
+async def refresh_product_index() -> Tuple[int, int]:
+    """
+    商品マスタ全件と索引を突き合わせ、追加・変更（商品名・価格など）と削除を反映します。
+    (反映件数, 削除件数) を返します。
+    """
+    rows = await read_database.fetch_all(products.select())
+    return product_index.sync(dict(row._mapping) for row in rows)
+
+
+async def run_product_index_refresh() -> None:
+    """
+    PRODUCT_INDEX_REFRESH_SEC ごとに索引を商品マスタと同期します（lifespan でタスクとして起動）。
+    """
+    while True:
+        await asyncio.sleep(PRODUCT_INDEX_REFRESH_SEC)
+        try:
+            changed, removed = await refresh_product_index()
+            if changed or removed:
+                print(f"🔁 商品検索索引を更新: 反映 {changed}件 / 削除 {removed}件")
+        except Exception as e:
+            print("❌ PRODUCT INDEX REFRESH ERROR:", str(e))
+
+
+async def fetch_catalog_version() -> int:
+    """
+    全ワーカー共通のカタログバージョンを取得します（レプリカ遅延を避けてプライマリから読む）。
+    """
+    query = catalog_versions.select().where(catalog_versions.c.id == 1)
+    row = await database.fetch_one(query)
+    return row.version if row else 0
+
+
+async def bump_catalog_version() -> int:
+    """
+    カタログバージョンを +1 して、他のワーカーにもキャッシュ破棄を知らせます。
+    """
+    await database.execute(
+        catalog_versions.update()
+        .where(catalog_versions.c.id == 1)
+        .values(version=catalog_versions.c.version + 1)
+    )
+    return await fetch_catalog_version()
+
+
+async def _reload_catalog(version: int) -> int:
+    """
+    キャッシュと検索索引を読み直し、version をこのワーカーの現在値にします。
+    version はプライマリから読んでいるので、商品マスタもプライマリから読む
+    （レプリカ遅延で古い価格を新しい version として覚えないため）。全件の読込は1回で、索引とキャッシュの両方に使う。
+    """
+    global catalog_version
+    async with _reload_lock:
+        if version <= catalog_version:
+            # 待っている間に同じ（か新しい）version で読み直し済み
+            return len(product_cache)
+        rows = await database.fetch_all(products.select().order_by(products.c.prd_id))
+        product_cache.clear()
+        catalog_version = version
+        product_index.build(dict(row._mapping) for row in rows)
+        for row in rows[:PRODUCT_CACHE_SIZE]:
+            product = dict(row._mapping)
+            product_cache.set(product["code"], product)
+        print(f"✅ 商品キャッシュ・検索索引を再読込: {len(rows)}件 (version={catalog_version})")
+        return min(len(rows), PRODUCT_CACHE_SIZE)
+
+
+async def run_catalog_version_watch() -> None:
+    """
+    PRODUCT_CACHE_VERSION_POLL_SEC ごとにカタログバージョンを確認し、
+    他のワーカーで更新されていればキャッシュと検索索引を読み直します（lifespan でタスクとして起動）。
+    """
+    while True:
+        await asyncio.sleep(PRODUCT_CACHE_VERSION_POLL_SEC)
+        try:
+            version = await fetch_catalog_version()
+            if version != catalog_version:
+                print(f"🔁 カタログ更新を検知: version {catalog_version} -> {version}")
+                await _reload_catalog(version)
+        except Exception as e:
+            print("❌ CATALOG VERSION WATCH ERROR:", str(e))
+
+
 @router.get("/search")
 async def search_product(code: str):
     """
     商品コードで商品情報を検索します。
     """
+    cached = product_cache.get(code)
+    if cached is _NOT_FOUND:
+        raise HTTPException(status_code=404, detail=None)
+    if cached is not None:
+        return cached
+
     query = products.select().where(products.c.code == code)
-    result = await database.fetch_one(query)
-    
+    result = await read_database.fetch_one(query)
+
     if result:
-        return result
+        return cache_product(result)
+    product_cache.set(code, _NOT_FOUND, ttl=PRODUCT_CACHE_NEGATIVE_TTL)
     raise HTTPException(status_code=404, detail=None)
+
+
+class BatchSearchRequest(BaseModel):
+    codes: List[str]
+
+
+@router.post("/batch")
+async def search_products_batch(request: BatchSearchRequest):
+    """
+    複数の商品コードをまとめて検索します（カート復元・スキャナの一括送信用）。
+    見つかった商品は入力順、見つからなかったコードは missing に返します。
+    """
+    codes = list(dict.fromkeys(request.codes))  # 重複除去（順序は維持）
+    found = {}
+    to_fetch = []
+    for code in codes:
+        cached = product_cache.get(code)
+        if cached is None:
+            to_fetch.append(code)
+        elif cached is not _NOT_FOUND:
+            found[code] = cached
+
+    for i in range(0, len(to_fetch), BATCH_CHUNK_SIZE):
+        chunk = to_fetch[i:i + BATCH_CHUNK_SIZE]
+        query = products.select().where(products.c.code.in_(chunk))
+        for row in await read_database.fetch_all(query):
+            product = cache_product(row)
+            found[product["code"]] = product
+
+    for code in to_fetch:
+        if code not in found:
+            product_cache.set(code, _NOT_FOUND, ttl=PRODUCT_CACHE_NEGATIVE_TTL)
+    missing = [code for code in codes if code not in found]
+
+    return {
+        "items": [found[code] for code in codes if code in found],
+        "missing": missing,
+    }
+
+
+@router.get("/suggest")
+async def suggest_products(q: str, limit: int = 10):
+    """
+    商品コード・商品名の一部から候補を返します（手入力用、DBには問い合わせない）。
+    全角/半角、カタカナ/ひらがなの違いは区別しません。
+    """
+    return {"items": product_index.search(q, min(max(limit, 0), 50))}
+
+
+@router.get("/cache/stats")
+async def product_cache_stats():
+    """
+    商品キャッシュのヒット/ミス件数を返します（このワーカー分）。
+    """
+    return {"version": catalog_version, **product_cache.stats()}
+
+
+@router.post("/cache/invalidate")
+async def invalidate_product_cache(code: Optional[str] = None):
+    """
+    価格変更などの後にキャッシュを破棄します。
+    code 指定時はこのワーカーではその商品のみ、未指定なら全件。
+    カタログバージョンを更新するので、他のワーカーも数秒以内に全件を読み直します
+    （code 指定でも各ワーカーが商品マスタ全件を1回読む。大量の個別更新は最後に1回だけ呼ぶこと）。
+    """
+    global catalog_version
+    if code is None:
+        product_cache.clear()
+    else:
+        product_cache.pop(code)
+    catalog_version = await bump_catalog_version()
+    return {"version": catalog_version, "invalidated": code or "all"}
+
+
+@router.post("/cache/reload")
+async def reload_product_cache():
+    """
+    キャッシュと検索索引を破棄して商品マスタから読み直します（全ワーカー共通の version を更新）。
+    """
+    loaded = await _reload_catalog(await bump_catalog_version())
+    return {"version": catalog_version, "loaded": loaded}
@@ -0,0 +1,178 @@
+import asyncio
+import os
+from dataclasses import dataclass
+from datetime import datetime
+from typing import List, Optional
+from database import database, transactions, transaction_details, purchase_keys
+import rollups
+
+# --- グループコミット設定 ---
+# 0 のときは無効（1リクエスト = 1トランザクション、従来どおり）
+GROUP_COMMIT_WINDOW_MS = float(os.getenv("GROUP_COMMIT_WINDOW_MS", "0"))
+# 窓の途中でもこの件数に達したら即コミット
+GROUP_COMMIT_MAX_BATCH = int(os.getenv("GROUP_COMMIT_MAX_BATCH", "50"))
+# 明細の複数行 INSERT 1回あたりの行数上限（max_allowed_packet を超えないように分割）
+DETAIL_INSERT_CHUNK_SIZE = int(os.getenv("DETAIL_INSERT_CHUNK_SIZE", "1000"))
+
+
+@dataclass
+class PurchaseRecord:
+    """
+    1件の購入（取引 1行 + 取引明細 n行）。
+    details には trd_id を含めない（登録時に採番された値を付与する）。
+    idem_key があれば取引冪等キーにも登録する（重複時は一意制約違反になる）。
+    request_hash はキーと一緒に記録するリクエスト内容のハッシュ（Idempotency-Key ヘッダー付きのとき）。
+    """
+    trd_values: dict
+    details: List[dict]
+    idem_key: Optional[str] = None
+    request_hash: Optional[str] = None
+
+
+async def write_purchases(records: List[PurchaseRecord]) -> List[int]:
+    """
+    複数の購入を1トランザクションで登録し、それぞれの trd_id を返します。
+    取引は1件ずつ INSERT（trd_id を確実に得るため）、明細は DETAIL_INSERT_CHUNK_SIZE 行ずつ INSERT で登録。
+    取引をまとめて INSERT しないのは、innodb_autoinc_lock_mode=2（MySQL 8 の既定）では
+    複数行 INSERT の採番が連番になる保証がなく、LAST_INSERT_ID から各行の trd_id を求められないため。
+    """
+    async with database.transaction():
+        trd_ids = []
+        for record in records:
+            trd_id = await database.execute(transactions.insert().values(**record.trd_values))
+            trd_ids.append(trd_id)
+
+        dtl_rows = [
+            {**detail, "trd_id": trd_id}
+            for record, trd_id in zip(records, trd_ids)
+            for detail in record.details
+        ]
+        for i in range(0, len(dtl_rows), DETAIL_INSERT_CHUNK_SIZE):
+            await database.execute(
+                transaction_details.insert().values(dtl_rows[i:i + DETAIL_INSERT_CHUNK_SIZE])
+            )
+
+        key_rows = [
+            {"idem_key": record.idem_key, "trd_id": trd_id, "created_at": datetime.now(),
+             "request_hash": record.request_hash}
+            for record, trd_id in zip(records, trd_ids)
+            if record.idem_key
+        ]
+        if key_rows:
+            await database.execute(purchase_keys.insert().values(key_rows))
+
+        if rollups.ROLLUP_MODE == "inline":
+            # 売上集計も同じトランザクションで加算
+            await rollups.apply_deltas(
+                rollups.collect_deltas((record.trd_values, record.details) for record in records)
+            )
+
+    return trd_ids
+
+
+async def find_purchase_keys(keys: List[str]) -> dict:
+    """
+    登録済みの冪等キーを {idem_key: trd_id} で返します。
+    """
+    if not keys:
+        return {}
+    query = purchase_keys.select().where(purchase_keys.c.idem_key.in_(keys))
+    return {row.idem_key: row.trd_id for row in await database.fetch_all(query)}
+
+
+async def find_purchase_key(key: str):
+    """
+    登録済みの冪等キーの行（trd_id, request_hash など）を返します。未登録なら None。
+    """
+    return await database.fetch_one(purchase_keys.select().where(purchase_keys.c.idem_key == key))
+
+
+class GroupCommitter:
+    """
+    短い窓の間に届いた購入をまとめて1トランザクションでコミットします。
+    呼び出し元はそれぞれ自分の trd_id（または自分のエラー）を受け取ります。
+    """
+
+    def __init__(self, window_ms: float, max_batch: int):
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self._pending = []
+        self._timer = None
+        self._tasks = set()
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0
+
+    async def submit(self, record: PurchaseRecord) -> int:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((record, future))
+
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+
+        return await future
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+
+        batch, self._pending = self._pending, []
+        task = asyncio.create_task(self._commit(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        # 停止時のキャンセルなど（開始前のキャンセルも含む）で結果を返せなかった呼び出し元を待たせたままにしない
+        task.add_done_callback(lambda _: self._release(batch))
+
+    @staticmethod
+    def _release(batch) -> None:
+        for _, future in batch:
+            if not future.done():
+                future.set_exception(RuntimeError("グループコミットが中断されました（登録されたかは不明）"))
+
+    async def _commit(self, batch) -> None:
+        try:
+            trd_ids = await write_purchases([record for record, _ in batch])
+        except Exception:
+            # まとめての登録に失敗したら1件ずつやり直し、エラーは該当する呼び出し元にだけ返す
+            print(f"⚠️ グループコミット失敗、個別登録に切替: {len(batch)}件")
+            for record, future in batch:
+                try:
+                    trd_id = (await write_purchases([record]))[0]
+                except Exception as e:
+                    if not future.done():
+                        future.set_exception(e)
+                else:
+                    if not future.done():
+                        future.set_result(trd_id)
+            return
+
+        for (_, future), trd_id in zip(batch, trd_ids):
+            if not future.done():
+                future.set_result(trd_id)
+
+    async def drain(self) -> None:
+        """
+        停止時に未コミット分を書き切ります。
+        """
+        self._flush()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+group_committer = GroupCommitter(GROUP_COMMIT_WINDOW_MS, GROUP_COMMIT_MAX_BATCH)
+
+
+async def save_purchase(record: PurchaseRecord) -> int:
+    """
+    購入を登録して trd_id を返します（グループコミット有効時はまとめて登録）。
+    """
+    if group_committer.enabled:
+        return await group_committer.submit(record)
+    return (await write_purchases([record]))[0]
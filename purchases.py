@@ -1,8 +1,12 @@
-from fastapi import APIRouter, HTTPException
-from pydantic import BaseModel, Field
+from fastapi import APIRouter, Header, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field, ValidationError
 from typing import List, Optional
 from datetime import datetime
-from database import database
+from database import DETAIL_QTY_MODE
+from purchase_store import PurchaseRecord, save_purchase, write_purchases, find_purchase_keys
+from idempotency import run_idempotent
+import json
 import traceback
 
 router = APIRouter()
@@ -29,54 +33,84 @@ class PurchaseRequest(BaseModel):
     total: int
     totalWithTax: int
 
+
+class BulkPurchaseRequest(PurchaseRequest):
+    # 端末側で採番する一意キー（再送時も同じ値を送る）
+    idempotency_key: str = Field(..., min_length=1, max_length=64)
+    # 端末で販売した日時（未指定なら登録時刻）。タイムゾーン付きはサーバーのローカル時刻に変換
+    sold_at: Optional[datetime] = None
+
 # -------------------------------
 # 💡 購入登録API（修正版）
 # -------------------------------
 
+def build_purchase_record(request: PurchaseRequest) -> PurchaseRecord:
+    """
+    リクエストから登録用の取引・明細行を組み立てます。
+    """
+    trd_values = {
+        "datetime": datetime.now(),
+        "emp_cd": "E001",
+        "store_cd": "S001",
+        "pos_no": "P01",
+        "total_amt": request.totalWithTax,
+        "ttl_amt_ex_tax": request.total
+    }
+
+    dtl_rows = []
+    for item in request.items:
+        if item.quantity <= 0:
+            # 数量0以下は明細を作らない（数量モードでも従来と同じ結果にする）
+            continue
+        dtl_values = {
+            "prd_id": item.product_id,
+            "prd_code": f"PRD{item.product_id}",
+            "prd_name": item.resolved_name,   # ← ここで name or product_name のどちらでもOK
+            "prd_price": item.price,
+            "tax_cd": "10"
+        }
+
+        if DETAIL_QTY_MODE:
+            # 数量モード: 1行 (qty=N) で記録
+            dtl_rows.append({**dtl_values, "qty": item.quantity})
+        else:
+            # 数量分の行を作成（DBへの往復は1回）
+            dtl_rows.extend(dtl_values for _ in range(item.quantity))
+
+    return PurchaseRecord(trd_values=trd_values, details=dtl_rows)
+
+
 @router.post("/purchases")
-async def create_purchase(request: PurchaseRequest):
+async def create_purchase(
+    request: PurchaseRequest,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+):
     """
     複数商品の購入情報を登録するAPI（name / product_name 両対応）
+    Idempotency-Key ヘッダー付きの再送は登録済みの trd_id をそのまま返します。
     """
+    async def replay(trd_id: int) -> dict:
+        return {"message": "取引および明細を登録しました", "trd_id": trd_id}
+
+    return await run_idempotent(
+        "purchases",
+        idempotency_key,
+        request,
+        lambda key, request_hash: _create_purchase(request, key, request_hash),
+        replay,
+    )
+
+
+async def _create_purchase(request: PurchaseRequest, idem_key: Optional[str], request_hash: Optional[str]) -> dict:
     try:
         print("🟢 購入登録開始:", request.dict())
 
-        async with database.transaction():
-            # --- 取引登録 ---
-            trd_query = """
-                INSERT INTO 取引 (datetime, emp_cd, store_cd, pos_no, total_amt, ttl_amt_ex_tax)
-                VALUES (:datetime, :emp_cd, :store_cd, :pos_no, :total_amt, :ttl_amt_ex_tax)
-            """
-            trd_values = {
-                "datetime": datetime.now(),
-                "emp_cd": "E001",
-                "store_cd": "S001",
-                "pos_no": "P01",
-                "total_amt": request.totalWithTax,
-                "ttl_amt_ex_tax": request.total
-            }
-            trd_id = await database.execute(trd_query, trd_values)
-            print(f"✅ 取引登録成功: trd_id={trd_id}")
-
-            # --- 明細登録 ---
-            for item in request.items:
-                dtl_query = """
-                    INSERT INTO 取引明細 (trd_id, prd_id, prd_code, prd_name, prd_price, tax_cd)
-                    VALUES (:trd_id, :prd_id, :prd_code, :prd_name, :prd_price, :tax_cd)
-                """
-                dtl_values = {
-                    "trd_id": trd_id,
-                    "prd_id": item.product_id,
-                    "prd_code": f"PRD{item.product_id}",
-                    "prd_name": item.resolved_name,   # ← ここで name or product_name のどちらでもOK
-                    "prd_price": item.price,
-                    "tax_cd": "10"
-                }
-
-                # 数量分ループ
-                for _ in range(item.quantity):
-                    await database.execute(dtl_query, dtl_values)
-                    print(f"🧾 明細登録: {item.resolved_name} x1")
+        # --- 取引 + 明細登録（明細は1回のINSERTでまとめて登録） ---
+        record = build_purchase_record(request)
+        record.idem_key = idem_key
+        record.request_hash = request_hash
+        trd_id = await save_purchase(record)
+        print(f"✅ 取引登録成功: trd_id={trd_id} / {len(request.items)}商品 / 明細{len(record.details)}行")
 
         print("🎉 全商品の登録完了")
         return {"message": "取引および明細を登録しました", "trd_id": trd_id}
@@ -86,3 +120,145 @@ async def create_purchase(request: PurchaseRequest):
         print("❌ PURCHASE INSERT ERROR:", str(e))
         print(tb)
         raise HTTPException(status_code=500, detail={"error": str(e), "traceback": tb})
+
+
+# -------------------------------
+# 💡 オフライン同期用 一括登録API（NDJSON）
+# -------------------------------
+
+# 1トランザクションで登録する件数
+BULK_CHUNK_SIZE = 100
+# 1行（1購入）の最大バイト数。超えた行はバッファせず invalid として返す
+BULK_MAX_LINE_BYTES = 64 * 1024
+
+# _iter_lines が上限超えの行の代わりに返す値
+_LINE_TOO_LONG = object()
+
+
+async def _iter_lines(request: Request):
+    """
+    リクエストボディを読みながら1行ずつ返します（全体をメモリに載せない）。
+    BULK_MAX_LINE_BYTES を超える行は読み捨てて _LINE_TOO_LONG を返します。
+    """
+    buffer = bytearray()
+    scanned = 0  # buffer のうち改行がないと確認済みの長さ
+    skipping = False  # 上限超えの行の残りを読み捨て中
+    async for chunk in request.stream():
+        buffer += chunk
+        start = 0
+        while True:
+            end = buffer.find(b"\n", max(start, scanned))
+            if end < 0:
+                break
+            if skipping:
+                skipping = False
+            elif end - start > BULK_MAX_LINE_BYTES:
+                yield _LINE_TOO_LONG
+            else:
+                yield bytes(buffer[start:end])
+            start = end + 1
+        del buffer[:start]
+        scanned = len(buffer)
+
+        if len(buffer) > BULK_MAX_LINE_BYTES:
+            if not skipping:
+                yield _LINE_TOO_LONG
+                skipping = True
+            buffer.clear()
+            scanned = 0
+    if buffer and not skipping:
+        yield bytes(buffer)
+
+
+async def _ingest_chunk(entries) -> List[dict]:
+    """
+    (行番号, BulkPurchaseRequest) のリストを1トランザクションで登録し、行ごとの結果を返します。
+    登録済みの冪等キーは duplicate として何もしません。
+    """
+    keys = [req.idempotency_key for _, req in entries]
+    existing = await find_purchase_keys(keys)
+
+    results = {}
+    pending = []
+    for line_no, req in entries:
+        key = req.idempotency_key
+        if key in existing:
+            results[line_no] = {"line": line_no, "key": key, "status": "duplicate", "trd_id": existing[key]}
+        elif any(key == other.idempotency_key for _, other in pending):
+            results[line_no] = {"line": line_no, "key": key, "status": "duplicate"}
+        else:
+            pending.append((line_no, req))
+
+    records = []
+    for _, req in pending:
+        record = build_purchase_record(req)
+        record.idem_key = req.idempotency_key
+        if req.sold_at is not None:
+            sold_at = req.sold_at
+            if sold_at.tzinfo is not None:
+                sold_at = sold_at.astimezone().replace(tzinfo=None)
+            record.trd_values["datetime"] = sold_at
+        records.append(record)
+
+    try:
+        trd_ids = await write_purchases(records) if records else []
+        for (line_no, req), trd_id in zip(pending, trd_ids):
+            results[line_no] = {"line": line_no, "key": req.idempotency_key, "status": "created", "trd_id": trd_id}
+    except Exception:
+        # 同時に別ワーカーが同じキーを登録した場合などは1件ずつやり直す
+        for (line_no, req), record in zip(pending, records):
+            key = req.idempotency_key
+            try:
+                trd_id = (await write_purchases([record]))[0]
+                results[line_no] = {"line": line_no, "key": key, "status": "created", "trd_id": trd_id}
+            except Exception as e:
+                found = await find_purchase_keys([key])
+                if key in found:
+                    results[line_no] = {"line": line_no, "key": key, "status": "duplicate", "trd_id": found[key]}
+                else:
+                    results[line_no] = {"line": line_no, "key": key, "status": "error", "error": str(e)}
+
+    return [results[line_no] for line_no, _ in entries]
+
+
+@router.post("/purchases/bulk")
+async def bulk_create_purchases(request: Request):
+    """
+    NDJSON（1行 = 1購入 + idempotency_key、任意で sold_at）をまとめて登録するAPI。
+    BULK_CHUNK_SIZE 件ごとに1トランザクションで登録し、行ごとの結果を NDJSON で返します。
+    """
+    statuses = []
+    entries = []
+    line_no = 0
+
+    async for raw in _iter_lines(request):
+        line_no += 1
+        if raw is _LINE_TOO_LONG:
+            statuses.append({
+                "line": line_no,
+                "status": "invalid",
+                "error": [{"type": "line_too_long", "msg": f"1行は {BULK_MAX_LINE_BYTES} バイト以内にしてください"}],
+            })
+            continue
+        if not raw.strip():
+            continue
+        try:
+            entries.append((line_no, BulkPurchaseRequest.model_validate_json(raw)))
+        except ValidationError as e:
+            statuses.append({"line": line_no, "status": "invalid", "error": e.errors(include_url=False, include_input=False)})
+            continue
+
+        if len(entries) >= BULK_CHUNK_SIZE:
+            statuses.extend(await _ingest_chunk(entries))
+            entries = []
+
+    if entries:
+        statuses.extend(await _ingest_chunk(entries))
+
+    statuses.sort(key=lambda s: s["line"])
+    created = sum(1 for s in statuses if s["status"] == "created")
+    print(f"📦 一括登録: {len(statuses)}件中 {created}件を新規登録")
+
+    # 結果は処理済みの行ごとに返す（ボディ読込と並行して返すと ASGI の受信と競合するため、読込完了後に送出）
+    lines = (json.dumps(s, ensure_ascii=False, default=str) + "\n" for s in statuses)
+    return StreamingResponse(lines, media_type="application/x-ndjson")
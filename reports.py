@@ -0,0 +1,91 @@
+import datetime
+from typing import Optional
+import sqlalchemy
+from fastapi import APIRouter, HTTPException
+from database import read_database, sales_hourly, sales_daily
+
+router = APIRouter(prefix="/reports")
+
+# 集計の切り口 -> グループ化する列
+_GROUP_COLUMNS = {
+    "store": ["store_cd"],
+    "pos": ["store_cd", "pos_no"],
+    "product": ["prd_id"],
+}
+
+
+def _filters(table, store_cd: Optional[str], pos_no: Optional[str], prd_id: Optional[int]):
+    conditions = []
+    if store_cd is not None:
+        conditions.append(table.c.store_cd == store_cd)
+    if pos_no is not None:
+        conditions.append(table.c.pos_no == pos_no)
+    if prd_id is not None:
+        conditions.append(table.c.prd_id == prd_id)
+    return conditions
+
+
+@router.get("/daily")
+async def daily_report(
+    start: datetime.date,
+    end: Optional[datetime.date] = None,
+    by: str = "store",
+    store_cd: Optional[str] = None,
+    pos_no: Optional[str] = None,
+    prd_id: Optional[int] = None,
+):
+    """
+    日別の売上（数量・金額）を 店舗 / レジ / 商品 単位で返します（売上集計_日次 から集計）。
+    """
+    if by not in _GROUP_COLUMNS:
+        raise HTTPException(status_code=400, detail=f"by は {', '.join(_GROUP_COLUMNS)} のいずれかを指定してください")
+    end = end or start
+
+    group_columns = [sales_daily.c.sales_date] + [sales_daily.c[name] for name in _GROUP_COLUMNS[by]]
+    query = (
+        sqlalchemy.select(
+            *group_columns,
+            sqlalchemy.func.sum(sales_daily.c.qty).label("qty"),
+            sqlalchemy.func.sum(sales_daily.c.amount).label("amount"),
+        )
+        .where(
+            sales_daily.c.sales_date >= start,
+            sales_daily.c.sales_date <= end,
+            *_filters(sales_daily, store_cd, pos_no, prd_id),
+        )
+        .group_by(*group_columns)
+        .order_by(*group_columns)
+    )
+    rows = await read_database.fetch_all(query)
+    return {"start": start, "end": end, "by": by, "rows": [dict(row._mapping) for row in rows]}
+
+
+@router.get("/hourly")
+async def hourly_report(
+    date: datetime.date,
+    store_cd: Optional[str] = None,
+    pos_no: Optional[str] = None,
+    prd_id: Optional[int] = None,
+):
+    """
+    指定日の時間帯別の売上（数量・金額）を返します（売上集計_時間 から集計）。
+    """
+    range_start = datetime.datetime.combine(date, datetime.time.min)
+    range_end = range_start + datetime.timedelta(days=1)
+
+    query = (
+        sqlalchemy.select(
+            sales_hourly.c.bucket,
+            sqlalchemy.func.sum(sales_hourly.c.qty).label("qty"),
+            sqlalchemy.func.sum(sales_hourly.c.amount).label("amount"),
+        )
+        .where(
+            sales_hourly.c.bucket >= range_start,
+            sales_hourly.c.bucket < range_end,
+            *_filters(sales_hourly, store_cd, pos_no, prd_id),
+        )
+        .group_by(sales_hourly.c.bucket)
+        .order_by(sales_hourly.c.bucket)
+    )
+    rows = await read_database.fetch_all(query)
+    return {"date": date, "rows": [dict(row._mapping) for row in rows]}
@@ -0,0 +1,193 @@
+# 売上集計（ロールアップ）の更新とバックフィル
+#
+# ROLLUP_MODE=inline のとき、購入登録と同じトランザクションで 売上集計_時間 / 売上集計_日次 を加算する。
+# 過去分の再構築（または inline 無効時の追いつき処理）は以下で実行:
+#
+#   python rollups.py backfill --start 2026-01-01 --end 2026-01-31
+
+import argparse
+import asyncio
+import datetime
+import os
+from typing import Dict, Iterable, List, Tuple
+
+import sqlalchemy
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+
+from database import (
+    database,
+    transactions,
+    transaction_details,
+    sales_hourly,
+    sales_daily,
+    fetch_trd_id_range,
+    DETAIL_QTY_MODE,
+)
+
+# inline: 購入登録時に加算 / off: 更新しない（バックフィルで追いつく）
+ROLLUP_MODE = os.getenv("ROLLUP_MODE", "off")
+# バックフィルで1トランザクションに含める取引件数
+BACKFILL_CHUNK_SIZE = int(os.getenv("ROLLUP_BACKFILL_CHUNK_SIZE", "1000"))
+
+_INSERT_BY_DIALECT = {
+    "mysql": mysql.insert,
+    "postgresql": postgresql.insert,
+    "sqlite": sqlite.insert,
+}
+
+# (bucket, store_cd, pos_no, prd_id) -> [qty, amount]
+Deltas = Dict[Tuple, List[int]]
+
+
+def collect_deltas(sales: Iterable[Tuple[dict, Iterable[dict]]]) -> Deltas:
+    """
+    (取引の値, 明細行のリスト) から時間単位の加算量を集計します。
+    """
+    deltas: Deltas = {}
+    for trd_values, details in sales:
+        bucket = trd_values["datetime"].replace(minute=0, second=0, microsecond=0)
+        for detail in details:
+            key = (bucket, trd_values["store_cd"], trd_values["pos_no"], detail["prd_id"])
+            qty = detail.get("qty", 1)
+            entry = deltas.setdefault(key, [0, 0])
+            entry[0] += qty
+            entry[1] += qty * (detail["prd_price"] or 0)
+    return deltas
+
+
+async def _upsert(table, key_columns: List[str], rows: List[dict]) -> None:
+    insert = _INSERT_BY_DIALECT[database.url.dialect]
+    stmt = insert(table).values(rows)
+    if database.url.dialect == "mysql":
+        stmt = stmt.on_duplicate_key_update(
+            qty=table.c.qty + stmt.inserted.qty,
+            amount=table.c.amount + stmt.inserted.amount,
+        )
+    else:
+        stmt = stmt.on_conflict_do_update(
+            index_elements=key_columns,
+            set_={
+                "qty": table.c.qty + stmt.excluded.qty,
+                "amount": table.c.amount + stmt.excluded.amount,
+            },
+        )
+    await database.execute(stmt)
+
+
+async def apply_deltas(deltas: Deltas) -> None:
+    """
+    集計量を時間別・日別テーブルへ加算します（呼び出し側のトランザクション内で実行）。
+    行ロックの順序を揃えるため、キー順に並べてから書き込みます。
+    """
+    if not deltas:
+        return
+
+    hourly_rows = []
+    daily: Deltas = {}
+    for (bucket, store_cd, pos_no, prd_id), (qty, amount) in sorted(deltas.items()):
+        hourly_rows.append({
+            "bucket": bucket, "store_cd": store_cd, "pos_no": pos_no,
+            "prd_id": prd_id, "qty": qty, "amount": amount,
+        })
+        entry = daily.setdefault((bucket.date(), store_cd, pos_no, prd_id), [0, 0])
+        entry[0] += qty
+        entry[1] += amount
+
+    daily_rows = [
+        {"sales_date": sales_date, "store_cd": store_cd, "pos_no": pos_no,
+         "prd_id": prd_id, "qty": qty, "amount": amount}
+        for (sales_date, store_cd, pos_no, prd_id), (qty, amount) in sorted(daily.items())
+    ]
+
+    await _upsert(sales_hourly, ["bucket", "store_cd", "pos_no", "prd_id"], hourly_rows)
+    await _upsert(sales_daily, ["sales_date", "store_cd", "pos_no", "prd_id"], daily_rows)
+
+
+async def backfill(start: datetime.date, end: datetime.date) -> int:
+    """
+    start〜end（両端含む）の集計を削除し、取引履歴から BACKFILL_CHUNK_SIZE 件ずつ積み直します。
+    inline 更新と同時に走らせると二重計上になるため、締め済みの期間に対して実行してください。
+    """
+    range_start = datetime.datetime.combine(start, datetime.time.min)
+    range_end = datetime.datetime.combine(end + datetime.timedelta(days=1), datetime.time.min)
+
+    async with database.transaction():
+        await database.execute(
+            sales_hourly.delete().where(
+                sales_hourly.c.bucket >= range_start, sales_hourly.c.bucket < range_end
+            )
+        )
+        await database.execute(
+            sales_daily.delete().where(
+                sales_daily.c.sales_date >= start, sales_daily.c.sales_date <= end
+            )
+        )
+
+    detail_columns = [
+        transaction_details.c.trd_id,
+        transaction_details.c.prd_id,
+        transaction_details.c.prd_price,
+    ]
+    if DETAIL_QTY_MODE:
+        detail_columns.append(transaction_details.c.qty)
+
+    # 期間内の trd_id の範囲を datetime インデックスで先に引き、その範囲だけをキーセットで走査
+    min_trd_id, max_trd_id = await fetch_trd_id_range(database, range_start, range_end)
+    if min_trd_id is None:
+        return 0
+
+    last_trd_id = min_trd_id - 1
+    total = 0
+    while True:
+        trd_query = (
+            sqlalchemy.select(transactions)
+            .where(
+                transactions.c.datetime >= range_start,
+                transactions.c.datetime < range_end,
+                transactions.c.trd_id > last_trd_id,
+                transactions.c.trd_id <= max_trd_id,
+            )
+            .order_by(transactions.c.trd_id)
+            .limit(BACKFILL_CHUNK_SIZE)
+        )
+        trd_rows = await database.fetch_all(trd_query)
+        if not trd_rows:
+            break
+
+        trd_ids = [row.trd_id for row in trd_rows]
+        dtl_query = sqlalchemy.select(*detail_columns).where(transaction_details.c.trd_id.in_(trd_ids))
+        details_by_trd: Dict[int, List[dict]] = {}
+        for row in await database.fetch_all(dtl_query):
+            details_by_trd.setdefault(row.trd_id, []).append(dict(row._mapping))
+
+        deltas = collect_deltas(
+            (dict(row._mapping), details_by_trd.get(row.trd_id, [])) for row in trd_rows
+        )
+        async with database.transaction():
+            await apply_deltas(deltas)
+
+        last_trd_id = trd_ids[-1]
+        total += len(trd_rows)
+        print(f"🔁 集計バックフィル: {total}件 (trd_id<={last_trd_id})")
+
+    return total
+
+
+async def _main() -> None:
+    parser = argparse.ArgumentParser(description="売上集計の再構築")
+    sub = parser.add_subparsers(dest="command", required=True)
+    backfill_parser = sub.add_parser("backfill")
+    backfill_parser.add_argument("--start", type=datetime.date.fromisoformat, required=True)
+    backfill_parser.add_argument("--end", type=datetime.date.fromisoformat, required=True)
+    args = parser.parse_args()
+
+    await database.connect()
+    try:
+        total = await backfill(args.start, args.end)
+        print(f"🎉 集計バックフィル完了: {total}件")
+    finally:
+        await database.disconnect()
+
+
+if __name__ == "__main__":
+    asyncio.run(_main())
@@ -1,10 +1,12 @@
 # frontend/backend/sales.py
 
-from fastapi import APIRouter, HTTPException, status
+from fastapi import APIRouter, Header, HTTPException, status
 from pydantic import BaseModel
-from typing import List
+from typing import List, Optional
 import datetime
-from database import database, transactions, transaction_details, products
+from database import database, products, transactions, DETAIL_QTY_MODE
+from purchase_store import PurchaseRecord, save_purchase
+from idempotency import run_idempotent
 
 router = APIRouter()
 
@@ -20,65 +22,89 @@ class PurchaseRequest(BaseModel):
     totalWithTax: int
 
 @router.post("/purchases", status_code=status.HTTP_201_CREATED)
-async def purchase(request: PurchaseRequest):
+async def purchase(
+    request: PurchaseRequest,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+):
     if not request.items:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="購入商品が指定されていません")
 
-    async with database.transaction() as transaction:
-        try:
-            total_amt_ex_tax = request.total
-            total_amt = request.totalWithTax
-
-            # 取引テーブルへの挿入
-            transaction_insert_query = transactions.insert().values(
-                datetime=datetime.datetime.now(),
-                emp_cd="EMP001", 
-                store_cd="STR01",
-                pos_no="POS01",  
-                total_amt=total_amt,
-                ttl_amt_ex_tax=total_amt_ex_tax
-            )
-            trd_id = await transaction.execute(transaction_insert_query)
-
-            # 取引明細テーブルへの挿入
-            details_to_insert = []
-            for item in request.items: # ★ ループ開始
-                product_query = products.select().where(products.c.prd_id == item.product_id)
-                db_product = await database.fetch_one(product_query)
-                
-                if not db_product:
-                    await transaction.rollback()
-                    raise HTTPException(status_code=404, detail=f"商品ID {item.product_id} がマスタに存在しません")
-
-                for _ in range(item.quantity):
-                    details_to_insert.append(
-                        {
-                            "trd_id": trd_id,
-                            "prd_id": item.product_id,
-                            "prd_code": db_product.code,
-                            "prd_name": db_product.name,
-                            "prd_price": db_product.price,
-                            "tax_cd": "10",
-                        }
-                    )
-            # ★ ループ終了
-            
-            # ▼▼▼ 修正箇所 ▼▼▼
-            # 'if' ブロックをループの外に（インデントを一段階浅く）修正
-            if details_to_insert:
-                await transaction.execute(transaction_details.insert().values(details_to_insert))
-            else:
-                await transaction.rollback()
-                raise HTTPException(status_code=400, detail="有効な購入明細がありません")
-            # ▲▲▲ 修正完了 ▲▲▲
-
-            return {
-                "success": True,
-                "trd_id": trd_id,
-                "total_amount": total_amt,
-                "total_amount_ex_tax": total_amt_ex_tax
-            }
-        
-        except Exception as e:
-            await transaction.rollback()
-            raise HTTPException(status_code=500, detail=f"購入処理中にエラーが発生しました: {e}")
\ No newline at end of file
+    # 再送時は登録済みの取引から応答を組み立てる（商品マスタ・明細には触れない）
+    async def replay(trd_id: int) -> dict:
+        trd = await database.fetch_one(transactions.select().where(transactions.c.trd_id == trd_id))
+        return {
+            "success": True,
+            "trd_id": trd_id,
+            "total_amount": trd.total_amt,
+            "total_amount_ex_tax": trd.ttl_amt_ex_tax
+        }
+
+    return await run_idempotent(
+        "sales",
+        idempotency_key,
+        request,
+        lambda key, request_hash: _purchase(request, key, request_hash),
+        replay,
+    )
+
+
+async def _purchase(request: PurchaseRequest, idem_key: Optional[str], request_hash: Optional[str]) -> dict:
+    # 商品マスタをまとめて1回で取得（トランザクション開始前に済ませる）
+    product_ids = {item.product_id for item in request.items}
+    product_query = products.select().where(products.c.prd_id.in_(product_ids))
+    db_products = {row.prd_id: row for row in await database.fetch_all(product_query)}
+
+    for item in request.items:
+        if item.product_id not in db_products:
+            raise HTTPException(status_code=404, detail=f"商品ID {item.product_id} がマスタに存在しません")
+
+    # 取引明細（価格などはマスタの値を記録）。数量0以下は明細にしない（数量モードでも同じ）
+    details_to_insert = []
+    for item in request.items:
+        if item.quantity <= 0:
+            continue
+        db_product = db_products[item.product_id]
+        detail = {
+            "prd_id": item.product_id,
+            "prd_code": db_product.code,
+            "prd_name": db_product.name,
+            "prd_price": db_product.price,
+            "tax_cd": "10",
+        }
+        if DETAIL_QTY_MODE:
+            details_to_insert.append({**detail, "qty": item.quantity})
+        else:
+            details_to_insert.extend(detail for _ in range(item.quantity))
+
+    if not details_to_insert:
+        raise HTTPException(status_code=400, detail="有効な購入明細がありません")
+
+    total_amt_ex_tax = request.total
+    total_amt = request.totalWithTax
+
+    record = PurchaseRecord(
+        trd_values={
+            "datetime": datetime.datetime.now(),
+            "emp_cd": "EMP001",
+            "store_cd": "STR01",
+            "pos_no": "POS01",
+            "total_amt": total_amt,
+            "ttl_amt_ex_tax": total_amt_ex_tax,
+        },
+        details=details_to_insert,
+        idem_key=idem_key,
+        request_hash=request_hash,
+    )
+
+    try:
+        # 取引 + 取引明細の挿入（グループコミット有効時はまとめて登録）
+        trd_id = await save_purchase(record)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"購入処理中にエラーが発生しました: {e}")
+
+    return {
+        "success": True,
+        "trd_id": trd_id,
+        "total_amount": total_amt,
+        "total_amount_ex_tax": total_amt_ex_tax
+    }
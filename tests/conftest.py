@@ -0,0 +1,6 @@
+import os
+import sys
+
+# database.py は import 時に DATABASE_URL を必須とする（テストでは接続しない）
+os.environ.setdefault("DATABASE_URL", "sqlite:///./test.db")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
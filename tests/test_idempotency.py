@@ -0,0 +1,141 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+from pydantic import BaseModel
+
+import idempotency
+from idempotency import request_hash, run_idempotent
+
+
+class Body(BaseModel):
+    total: int
+
+
+@pytest.fixture(autouse=True)
+def store(monkeypatch):
+    """
+    取引冪等キー の代わり（key -> 行）。handler が登録したら stored に入れる。
+    """
+    stored = {}
+
+    async def find_purchase_key(key):
+        await asyncio.sleep(0)
+        return stored.get(key)
+
+    monkeypatch.setattr(idempotency, "find_purchase_key", find_purchase_key)
+    idempotency.response_cache.clear()
+    idempotency._in_flight.clear()
+    return stored
+
+
+async def replay(trd_id):
+    return {"trd_id": trd_id, "replayed": True}
+
+
+def make_handler(store, calls, delay=0.01):
+    async def handler(key, digest):
+        calls.append(key)
+        await asyncio.sleep(delay)
+        trd_id = len(calls)
+        if key is not None:
+            store[key] = SimpleNamespace(trd_id=trd_id, request_hash=digest)
+        return {"trd_id": trd_id}
+
+    return handler
+
+
+def test_concurrent_requests_with_same_key_run_once(store):
+    calls = []
+
+    async def run():
+        handler = make_handler(store, calls)
+        return await asyncio.gather(*(run_idempotent("sales", "k", Body(total=1), handler, replay) for _ in range(3)))
+
+    assert asyncio.run(run()) == [{"trd_id": 1}] * 3
+    assert calls == ["k"]
+
+
+def test_waiters_take_over_when_owner_is_cancelled(store):
+    calls = []
+
+    async def run():
+        handler = make_handler(store, calls, delay=0.05)
+        owner = asyncio.create_task(run_idempotent("sales", "k", Body(total=1), handler, replay))
+        await asyncio.sleep(0.01)
+        waiters = [asyncio.create_task(run_idempotent("sales", "k", Body(total=1), handler, replay)) for _ in range(2)]
+        await asyncio.sleep(0)
+        owner.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await owner
+        return await asyncio.gather(*waiters)
+
+    assert asyncio.run(run()) == [{"trd_id": 2}] * 2
+    assert calls == ["k", "k"]
+    assert idempotency._in_flight == {}
+
+
+def test_unique_violation_replays_stored_transaction(store):
+    async def handler(key, digest):
+        # 別ワーカーが先に登録 → こちらは一意制約違反
+        store[key] = SimpleNamespace(trd_id=7, request_hash=digest)
+        raise RuntimeError("Duplicate entry")
+
+    result = asyncio.run(run_idempotent("sales", "k", Body(total=1), handler, replay))
+    assert result == {"trd_id": 7, "replayed": True}
+
+
+def test_reused_key_with_different_body_is_rejected(store):
+    calls = []
+    handler = make_handler(store, calls)
+
+    async def run(total):
+        return await run_idempotent("sales", "k", Body(total=total), handler, replay)
+
+    assert asyncio.run(run(1)) == {"trd_id": 1}
+    # 応答キャッシュ
+    with pytest.raises(HTTPException) as cached:
+        asyncio.run(run(2))
+    assert cached.value.status_code == 422
+    # 取引冪等キー
+    idempotency.response_cache.clear()
+    with pytest.raises(HTTPException) as stored:
+        asyncio.run(run(2))
+    assert stored.value.status_code == 422
+    assert asyncio.run(run(1)) == {"trd_id": 1, "replayed": True}
+    assert calls == ["k"]
+
+
+def test_reused_key_with_different_body_while_in_flight_is_rejected(store):
+    calls = []
+
+    async def run():
+        handler = make_handler(store, calls, delay=0.05)
+        first = asyncio.create_task(run_idempotent("sales", "k", Body(total=1), handler, replay))
+        await asyncio.sleep(0.01)
+        with pytest.raises(HTTPException) as conflict:
+            await run_idempotent("sales", "k", Body(total=2), handler, replay)
+        assert conflict.value.status_code == 422
+        return await first
+
+    assert asyncio.run(run()) == {"trd_id": 1}
+
+
+def test_cache_is_scoped_by_route(store):
+    calls = []
+    handler = make_handler(store, calls)
+    assert asyncio.run(run_idempotent("purchases", "k", Body(total=1), handler, replay)) == {"trd_id": 1}
+    # 別の API で同じキー: キャッシュの応答（別の形）は返さず、取引冪等キー の内容違いとして 422
+    with pytest.raises(HTTPException) as conflict:
+        asyncio.run(run_idempotent("sales", "k", Body(total=1), handler, replay))
+    assert conflict.value.status_code == 422
+    assert request_hash("purchases", Body(total=1)) != request_hash("sales", Body(total=1))
+
+
+def test_without_key_always_runs_handler(store):
+    calls = []
+    handler = make_handler(store, calls)
+    for _ in range(2):
+        asyncio.run(run_idempotent("sales", None, Body(total=1), handler, replay))
+    assert calls == [None, None]
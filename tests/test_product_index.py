@@ -0,0 +1,79 @@
+from product_index import ProductIndex, normalize
+
+
+def _product(prd_id, code, name):
+    return {"prd_id": prd_id, "code": code, "name": name, "price": 100}
+
+
+def _ids(index, query, limit=10):
+    return [p["prd_id"] for p in index.search(query, limit)]
+
+
+def test_normalize():
+    assert normalize("ＡＢＣ１２３") == "abc123"
+    assert normalize("ｶﾌｪﾗﾃ") == "かふぇらて"
+    assert normalize("カフェ ラテ　Ｌ") == "かふぇらてl"
+    assert normalize("") == ""
+    assert normalize(None) == ""
+
+
+def test_ranking_order():
+    index = ProductIndex()
+    index.build([
+        _product(1, "4901", "アイスカフェラテ"),
+        _product(2, "4902", "カフェラテ"),
+        _product(3, "ラテ01", "ミルク"),
+        _product(4, "ラテ", "ミルク"),
+        _product(5, "4905", "ラテ"),
+        _product(6, "4906", "カフェラテ ラージ"),
+        _product(7, "4907", "ミルクティー"),
+    ])
+    # コード完全一致 > コード前方一致 > 商品名前方一致 > 部分一致（出現位置、名前の短さ順）
+    assert _ids(index, "らて") == [4, 3, 5, 2, 6, 1]
+    assert _ids(index, "らて", limit=3) == [4, 3, 5]
+    assert _ids(index, "ﾗﾃ") == _ids(index, "らて")
+
+
+def test_single_character_query():
+    index = ProductIndex()
+    index.build([_product(1, "4901", "おにぎり 鮭"), _product(2, "4902", "鮭弁当"), _product(3, "4903", "ツナ")])
+    assert _ids(index, "鮭") == [2, 1]
+    assert _ids(index, "ぎ") == [1]
+    assert _ids(index, "x") == []
+
+
+def test_early_exit_keeps_best_matches():
+    index = ProductIndex()
+    # 先頭に出現する商品が後ろの方の prd_id にしかない場合も上位に来る
+    rows = [_product(i, f"49{i:05d}", "おにぎり ツナマヨ") for i in range(1, 200)]
+    rows.append(_product(500, "4950000", "ツナ"))
+    index.build(rows)
+    assert _ids(index, "つな", limit=3) == [500, 1, 2]
+
+
+def test_sync_reflects_added_renamed_and_deleted_rows():
+    index = ProductIndex()
+    index.build([_product(1, "4901", "おにぎり 鮭"), _product(2, "4902", "緑茶"), _product(3, "4903", "メロンパン")])
+
+    changed, removed = index.sync([
+        _product(1, "4901", "おにぎり 梅"),  # 改名
+        _product(3, "4903", "メロンパン"),  # 変更なし
+        _product(4, "4904", "麦茶"),  # 追加
+    ])
+    assert (changed, removed) == (2, 1)
+    assert _ids(index, "鮭") == []
+    assert _ids(index, "梅") == [1]
+    assert _ids(index, "茶") == [4]
+    assert len(index) == 3
+    assert index.sync([_product(1, "4901", "おにぎり 梅"), _product(3, "4903", "メロンパン"), _product(4, "4904", "麦茶")]) == (0, 0)
+
+
+def test_upsert_matches_build():
+    rows = [_product(i, f"49{i:03d}", name) for i, name in enumerate(["カフェラテ", "ラテ", "おにぎり 鮭", "鮭", "ミルク"], 1)]
+    built = ProductIndex()
+    built.build(rows)
+    incremental = ProductIndex()
+    for row in reversed(rows):
+        incremental.upsert(row)
+    for query in ["らて", "鮭", "49", "る", "おに"]:
+        assert _ids(incremental, query) == _ids(built, query)
@@ -0,0 +1,78 @@
+import asyncio
+
+import pytest
+
+import purchase_store
+from purchase_store import GroupCommitter, PurchaseRecord
+
+
+def _record(name: str) -> PurchaseRecord:
+    return PurchaseRecord(trd_values={"name": name}, details=[])
+
+
+def test_batch_is_written_in_one_call(monkeypatch):
+    calls = []
+
+    async def write_purchases(records):
+        calls.append([r.trd_values["name"] for r in records])
+        return [100 + i for i in range(len(records))]
+
+    monkeypatch.setattr(purchase_store, "write_purchases", write_purchases)
+
+    async def run():
+        committer = GroupCommitter(window_ms=10, max_batch=50)
+        return await asyncio.gather(*(committer.submit(_record(n)) for n in "abc"))
+
+    assert asyncio.run(run()) == [100, 101, 102]
+    assert calls == [["a", "b", "c"]]
+
+
+def test_failed_record_only_fails_its_caller(monkeypatch):
+    calls = []
+
+    async def write_purchases(records):
+        names = [r.trd_values["name"] for r in records]
+        calls.append(names)
+        if "bad" in names:
+            raise ValueError("duplicate key")
+        return [ord(names[0])]
+
+    monkeypatch.setattr(purchase_store, "write_purchases", write_purchases)
+
+    async def run():
+        committer = GroupCommitter(window_ms=10, max_batch=3)
+        return await asyncio.gather(
+            *(committer.submit(_record(n)) for n in ["a", "bad", "c"]),
+            return_exceptions=True,
+        )
+
+    a, bad, c = asyncio.run(run())
+    assert (a, c) == (ord("a"), ord("c"))
+    assert isinstance(bad, ValueError)
+    assert calls == [["a", "bad", "c"], ["a"], ["bad"], ["c"]]
+
+
+@pytest.mark.parametrize("started", [False, True])
+def test_cancelled_commit_releases_callers(monkeypatch, started):
+    entered = []
+
+    async def write_purchases(records):
+        entered.append(True)
+        await asyncio.sleep(3600)
+
+    monkeypatch.setattr(purchase_store, "write_purchases", write_purchases)
+
+    async def run():
+        committer = GroupCommitter(window_ms=10, max_batch=1)
+        caller = asyncio.ensure_future(committer.submit(_record("a")))
+        await asyncio.sleep(0)
+        if started:
+            while not entered:
+                await asyncio.sleep(0)
+        for task in committer._tasks:
+            task.cancel()
+        return await asyncio.wait_for(caller, timeout=1)
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(run())
+    assert bool(entered) == started
@@ -0,0 +1,39 @@
+import asyncio
+
+import pytest
+
+import purchases
+from purchases import _LINE_TOO_LONG, _iter_lines
+
+
+class _Body:
+    def __init__(self, chunks):
+        self._chunks = chunks
+
+    async def stream(self):
+        for chunk in self._chunks:
+            yield chunk
+
+
+def _lines(chunks):
+    async def run():
+        return [line async for line in _iter_lines(_Body(chunks))]
+
+    return asyncio.run(run())
+
+
+def test_lines_split_across_chunks():
+    assert _lines([b"ab", b"c\nd", b"ef\n\ngh"]) == [b"abc", b"def", b"", b"gh"]
+
+
+def test_one_byte_chunks():
+    body = b"one\ntwo\nthree"
+    assert _lines([body[i:i + 1] for i in range(len(body))]) == [b"one", b"two", b"three"]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 1000])
+def test_oversized_line_is_reported_once_and_skipped(monkeypatch, chunk_size):
+    monkeypatch.setattr(purchases, "BULK_MAX_LINE_BYTES", 10)
+    body = b"ok\n" + b"x" * 25 + b"\nnext\n" + b"y" * 11
+    chunks = [body[i:i + chunk_size] for i in range(0, len(body), chunk_size)]
+    assert _lines(chunks) == [b"ok", _LINE_TOO_LONG, b"next", _LINE_TOO_LONG]
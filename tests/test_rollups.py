@@ -0,0 +1,34 @@
+import datetime
+
+from rollups import collect_deltas
+
+TRD = {"datetime": datetime.datetime(2026, 1, 2, 10, 45, 12), "store_cd": "S001", "pos_no": "P01"}
+BUCKET = datetime.datetime(2026, 1, 2, 10, 0)
+
+
+def test_per_unit_rows_count_one_each():
+    details = [{"prd_id": 1, "prd_price": 100}, {"prd_id": 1, "prd_price": 100}, {"prd_id": 2, "prd_price": 50}]
+    assert collect_deltas([(TRD, details)]) == {
+        (BUCKET, "S001", "P01", 1): [2, 200],
+        (BUCKET, "S001", "P01", 2): [1, 50],
+    }
+
+
+def test_qty_mode_uses_qty():
+    details = [{"prd_id": 1, "prd_price": 100, "qty": 3}]
+    assert collect_deltas([(TRD, details)]) == {(BUCKET, "S001", "P01", 1): [3, 300]}
+
+
+def test_zero_qty_is_not_counted_as_one():
+    details = [{"prd_id": 1, "prd_price": 100, "qty": 0}]
+    assert collect_deltas([(TRD, details)]) == {(BUCKET, "S001", "P01", 1): [0, 0]}
+
+
+def test_sales_in_same_hour_are_summed():
+    later = {**TRD, "datetime": datetime.datetime(2026, 1, 2, 10, 59, 59)}
+    next_hour = {**TRD, "datetime": datetime.datetime(2026, 1, 2, 11, 0)}
+    details = [{"prd_id": 1, "prd_price": None, "qty": 2}]
+    assert collect_deltas([(TRD, details), (later, details), (next_hour, details)]) == {
+        (BUCKET, "S001", "P01", 1): [4, 0],
+        (BUCKET.replace(hour=11), "S001", "P01", 1): [2, 0],
+    }